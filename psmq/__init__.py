@@ -1,3 +1,7 @@
 """Top-level package for psmq."""
 
 __version__: str = "0.1.0"
+
+from psmq.manager import QueueManager
+
+__all__ = ["QueueManager"]
@@ -0,0 +1,221 @@
+"""Fire-and-forget message pushing with a background pipeline flusher."""
+
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, wait
+from typing import Any, Deque, List, Optional, Tuple
+
+from redis import Redis
+from redis.client import Pipeline
+
+from psmq import queue_ops
+from psmq.serialize import SerializedMessage
+
+_Pending = Tuple[Any, "Future[str]"]
+
+
+class _BackgroundBatcher(ABC):
+    """
+    Send commands from a background thread, in pipelined batches.
+
+    Subclasses queue an item with :meth:`_submit`, and say how to add a batch of items to a
+    pipeline with :meth:`_add_commands`. The futures resolve to the decoded replies.
+
+    Args:
+        connection: The Redis connection
+        thread_name: The name of the background thread
+        batch_size: The most items to send in one pipeline
+        linger_ms: How long to wait for more items before sending a partial batch
+    """
+
+    def __init__(self, connection: Redis, thread_name: str, batch_size: int = 100, linger_ms: int = 5):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self._pending: Deque[_Pending] = deque()
+        self._in_flight: List["Future[str]"] = []  # The futures of the batch being sent
+        self._condition = threading.Condition()
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=thread_name, daemon=True)
+        self._thread.start()
+
+    def _submit(self, item: Any) -> "Future[str]":
+        """Queue an item to be sent and return the future for its reply."""
+        future: "Future[str]" = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(f"Cannot send with a closed {type(self).__name__}.")
+            self._pending.append((item, future))
+            # Wake the sender for the first item, so it starts lingering, and for a full batch.
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        return future
+
+    @abstractmethod
+    def _add_commands(self, pipeline: Pipeline, items: List[Any]) -> None:
+        """Add one command per item to the pipeline."""
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Send everything waiting now and wait until it is sent.
+
+        This includes a batch the background thread has already taken and is still sending.
+
+        Args:
+            timeout: The most seconds to wait, or ``None`` to wait until it is sent
+        """
+        with self._condition:
+            futures = [future for _, future in self._pending]
+            if futures:
+                self._flush_requested = True
+                self._condition.notify()
+            futures.extend(self._in_flight)
+        wait(futures, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Send everything waiting and stop the background thread.
+
+        Args:
+            timeout: The most seconds to wait for the thread, or ``None`` to wait until it stops
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _next_batch(self) -> List[_Pending]:
+        """Wait for a batch to be ready and take it off the pending queue."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed)
+            self._condition.wait_for(
+                lambda: len(self._pending) >= self.batch_size or self._flush_requested or self._closed,
+                timeout=self.linger,
+            )
+            count = min(len(self._pending), self.batch_size)
+            batch = [self._pending.popleft() for _ in range(count)]
+            # The batch's futures stay visible to flush until they are resolved.
+            self._in_flight = [future for _, future in batch]
+            if not self._pending:
+                self._flush_requested = False
+            return batch
+
+    def _send(self, batch: List[_Pending]) -> None:
+        """
+        Send a batch in one pipeline and resolve its futures.
+
+        An error building or sending the commands is set on every future in the batch, so the
+        background thread keeps running.
+        """
+        try:
+            tx = self.connection.pipeline(transaction=False)
+            self._add_commands(tx, [item for item, _ in batch])
+            replies = tx.execute()
+        except Exception as e:  # NOQA: BLE001
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), reply in zip(batch, replies):
+            future.set_result(reply.decode("utf8"))
+
+    def _run(self) -> None:
+        """Send batches until closed and nothing is waiting."""
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+            elif self._closed:
+                return
+
+
+class BatchedProducer(_BackgroundBatcher):
+    """
+    Push messages to a queue from a background thread, in pipelined batches.
+
+    :meth:`push` returns straight away with a :class:`~concurrent.futures.Future` for
+    the message id. A daemon thread sends the waiting messages in one pipeline as soon as
+    ``batch_size`` of them are waiting, or ``linger_ms`` after the first one arrived.
+
+    Messages from one producer reach Redis in the order they were pushed. If a batch fails,
+    the exception is set on the future of every message in that batch.
+
+    Messages that are still waiting when the interpreter exits are lost, so call
+    :meth:`flush` or :meth:`close` before shutting down.
+
+    Args:
+        connection: The Redis connection, with the PSMQ library loaded
+        queue_name: The name of the queue to push to
+        batch_size: The most messages to send in one pipeline
+        linger_ms: How long to wait for more messages before sending a partial batch
+    """
+
+    def __init__(self, connection: Redis, queue_name: str, batch_size: int = 100, linger_ms: int = 5):
+        self.queue_name = queue_name
+        super().__init__(connection, f"psmq-producer-{queue_name}", batch_size, linger_ms)
+
+    def push(self, message: SerializedMessage, delay: Optional[int] = None) -> "Future[str]":
+        """
+        Queue a serialized message to be sent.
+
+        Args:
+            message: The serialized message
+            delay: The time in seconds that the delivery of the message will be delayed
+
+        Raises:
+            RuntimeError: If the producer is closed
+
+        Returns:
+            A future that resolves to the message id once it is sent
+        """
+        return self._submit((message, delay))
+
+    def _add_commands(self, pipeline: Pipeline, items: List[Tuple[SerializedMessage, Optional[int]]]) -> None:
+        """Add a ``push_message`` call for each message."""
+        for message, delay in items:
+            queue_ops.push_message(pipeline, self.queue_name, message, delay=delay)
+
+
+class BatchedPublisher(_BackgroundBatcher):
+    """
+    Publish messages to a stream from a background thread, in pipelined batches.
+
+    This works like :class:`BatchedProducer`, sending ``XADD`` commands instead of queue pushes.
+
+    Args:
+        connection: The Redis connection
+        stream_name: The name of the stream to publish to
+        batch_size: The most messages to send in one pipeline
+        linger_ms: How long to wait for more messages before sending a partial batch
+    """
+
+    def __init__(self, connection: Redis, stream_name: str, batch_size: int = 100, linger_ms: int = 5):
+        self.stream_name = stream_name
+        super().__init__(connection, f"psmq-publisher-{stream_name}", batch_size, linger_ms)
+
+    def publish(self, fields: dict) -> "Future[str]":
+        """
+        Queue a message to be published.
+
+        Args:
+            fields: The message fields
+
+        Raises:
+            RuntimeError: If the publisher is closed
+
+        Returns:
+            A future that resolves to the message id once it is published
+        """
+        return self._submit(fields)
+
+    def _add_commands(self, pipeline: Pipeline, items: List[dict]) -> None:
+        """Add an ``XADD`` for each message."""
+        for fields in items:
+            pipeline.xadd(self.stream_name, fields)
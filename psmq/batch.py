@@ -0,0 +1,134 @@
+"""Run a mix of queue operations in one round trip."""
+
+from concurrent.futures import Future
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple, Type, Union
+
+from redis import Redis
+
+from psmq import queue_ops
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from psmq.message import ReceivedMessage
+
+_Operation = Tuple["Future[Any]", Callable[[Any], Any]]
+
+
+def _decode_msg_id(reply: bytes) -> str:
+    """Decode the id returned by a push."""
+    return reply.decode("utf8")
+
+
+def _ignore_reply(reply: Any) -> None:
+    """Discard the reply of an operation that returns nothing."""
+    return None
+
+
+class QueueBatch:
+    """
+    Collect pushes, gets and deletes on any queues and send them in one pipeline.
+
+    Each operation returns a :class:`~concurrent.futures.Future` straight away. Nothing is
+    sent until the batch is executed, which happens when the ``with`` block exits. Then every
+    future gets its result, or the exception Redis raised for that operation.
+
+    Example:
+        .. code-block:: python
+
+            with QueueBatch(conn) as batch:
+                sent = batch.push("jobs", b'{"id": 1}')
+                received = batch.get("results")
+            print(sent.result(), received.result())
+
+    Args:
+        connection: The Redis connection, with the PSMQ library loaded
+    """
+
+    def __init__(self, connection: Redis):
+        self.connection = connection
+        self._pipeline = connection.pipeline(transaction=False)
+        self._operations: List[_Operation] = []
+
+    def __enter__(self) -> "QueueBatch":
+        """Start collecting operations."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional["TracebackType"],
+    ) -> None:
+        """Execute the batch, or discard it if the block raised."""
+        if exc_type is None:
+            self.execute()
+        else:
+            self._pipeline.reset()
+
+    def _add(self, parse: Callable[[Any], Any]) -> "Future[Any]":
+        """Record the future and reply parser for the command just added to the pipeline."""
+        future: "Future[Any]" = Future()
+        self._operations.append((future, parse))
+        return future
+
+    def push(
+        self, queue_name: str, message: bytes, delay: Optional[int] = None, metadata: Optional[dict] = None
+    ) -> "Future[str]":
+        """
+        Add a push of a serialized message.
+
+        Args:
+            queue_name: The name of the queue
+            message: The serialized message
+            delay: The time in seconds that the delivery of the message will be delayed
+            metadata: Metadata to store with the message
+
+        Returns:
+            A future that resolves to the message id
+        """
+        queue_ops.push_message(self._pipeline, queue_name, message, delay=delay, metadata=metadata)
+        return self._add(_decode_msg_id)
+
+    def get(self, queue_name: str, visibility_timeout: Optional[int] = None) -> "Future[Optional[ReceivedMessage]]":
+        """
+        Add a receive of one message.
+
+        The message data is not deserialized.
+
+        Args:
+            queue_name: The name of the queue
+            visibility_timeout: The visibility timeout for the message, or ``None`` to use the queue's
+
+        Returns:
+            A future that resolves to the message, or ``None`` if the queue had no visible messages
+        """
+        queue_ops.request_message(self._pipeline, queue_name, visibility_timeout)
+        return self._add(partial(queue_ops.parse_message_reply, queue_name))
+
+    def delete(self, queue_name: str, msg_id: Union[bytes, str]) -> "Future[None]":
+        """
+        Add a delete of a message.
+
+        Args:
+            queue_name: The name of the queue
+            msg_id: The id of the message to delete
+
+        Returns:
+            A future that resolves once the message is deleted
+        """
+        queue_ops.delete_message(self._pipeline, queue_name, msg_id)  # type: ignore[arg-type]
+        return self._add(_ignore_reply)
+
+    def execute(self) -> None:
+        """Send all the collected operations in one round trip and resolve their futures."""
+        operations, self._operations = self._operations, []
+        if not operations:
+            return
+        replies = self._pipeline.execute(raise_on_error=False)
+        for (future, parse), reply in zip(operations, replies):
+            if isinstance(reply, Exception):
+                future.set_exception(reply)
+            else:
+                future.set_result(parse(reply))
@@ -1,27 +1,118 @@
 """Connection managers for queues."""
 
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
+from weakref import WeakSet
 
-from redis import Redis
+from redis import ConnectionPool, Redis
 
 PSMQ_LIBRARY_FILE = Path(__file__).parent.joinpath("psmq_library.lua")
 
+PSMQ_LIBRARY = PSMQ_LIBRARY_FILE.read_text(encoding="utf-8")
+"""The contents of the PSMQ Lua library, read once at import."""
+
+_LOADED_POOLS: "WeakSet[ConnectionPool]" = WeakSet()
+"""Connection pools whose Redis server already has the PSMQ library loaded."""
+
 
 def setup_redis_connection(connection: Redis) -> Redis:
-    """Load the PSMQ Lua library into the Redis connection."""
-    psmq_library = PSMQ_LIBRARY_FILE.read_text()
-    connection.function_load(psmq_library)  # type: ignore[attr-defined]
+    """
+    Load the PSMQ Lua library into the Redis connection.
+
+    The library is only uploaded the first time a connection pool is seen, so
+    creating several clients that share a pool does not re-send it.
+
+    PSMQ needs the raw ``bytes`` replies, because message bodies and metadata are binary,
+    so clients created with ``decode_responses=True`` are not supported.
+
+    Args:
+        connection: The Redis connection to set up
+
+    Raises:
+        ValueError: If the connection decodes its responses
+
+    Returns:
+        The same connection, ready for use with PSMQ
+    """
+    if connection.get_encoder().decode_responses:
+        raise ValueError("PSMQ needs raw replies. Create the Redis client without decode_responses.")
+    if connection.connection_pool not in _LOADED_POOLS:
+        connection.function_load(PSMQ_LIBRARY, replace=True)  # type: ignore[attr-defined]
+        _LOADED_POOLS.add(connection.connection_pool)
     return connection
 
 
-def get_redis_from_url(url: str) -> Redis:
-    """Instantiate this class using a redis:// URL."""
-    connection = Redis.from_url(url)
+def reload_library(connection: Redis) -> Redis:
+    """
+    Load the PSMQ library again, for a server that lost it.
+
+    A server loses its functions after ``FUNCTION FLUSH``, a restart without persistence, or a
+    failover to a replica that never had them. The pool is forgotten first, so the library is sent
+    even though :func:`setup_redis_connection` already saw it.
+    """
+    _LOADED_POOLS.discard(connection.connection_pool)
+    return setup_redis_connection(connection)
+
+
+@lru_cache(maxsize=32)
+def _cached_client_from_url(url: str, max_connections: Optional[int] = None, **kwargs) -> Redis:
+    """Create and set up a client for a URL, reusing it for calls with the same arguments."""
+    connection = Redis.from_url(url, max_connections=max_connections, **kwargs)
     return setup_redis_connection(connection)
 
 
+def get_redis_from_url(url: str, max_connections: Optional[int] = None, **kwargs) -> Redis:
+    """
+    Instantiate this class using a redis:// URL.
+
+    The client checks a connection out of its pool for each command, so one client
+    can be shared between threads. Raise ``max_connections`` to let more threads
+    talk to Redis at the same time.
+
+    Clients are cached, so calling this again with the same arguments returns the
+    same client instead of opening a new pool. Options that can't be hashed, such as
+    a list for ``retry_on_error``, can't be cached, so they get a new client each time.
+
+    Args:
+        url: The redis:// URL of the server
+        max_connections: The maximum number of connections in the client's pool
+        **kwargs: Other options passed to :meth:`redis.Redis.from_url`
+
+    Returns:
+        A Redis client with the PSMQ library loaded
+    """
+    try:
+        return _cached_client_from_url(url, max_connections, **kwargs)
+    except TypeError:
+        # lru_cache raises TypeError for unhashable arguments before calling the function.
+        connection = Redis.from_url(url, max_connections=max_connections, **kwargs)
+        return setup_redis_connection(connection)
+
+
+def get_redis_from_pool(pool: ConnectionPool) -> Redis:
+    """
+    Instantiate this class using an existing connection pool.
+
+    Clients created from the same pool share its connections, and the PSMQ
+    library is only loaded for the first of them.
+
+    Args:
+        pool: The connection pool to use
+
+    Returns:
+        A Redis client with the PSMQ library loaded
+    """
+    return setup_redis_connection(Redis(connection_pool=pool))
+
+
+@lru_cache(maxsize=32)
 def get_redis_from_path(path: Path) -> Redis:
-    """Instantiate this class using a path to a RedisLite file."""
+    """
+    Instantiate this class using a path to a RedisLite file.
+
+    Clients are cached by path, so the embedded server is only started once per directory.
+    """
     from redislite import Redis as RedisLite
 
     connection = RedisLite(path / "queue.rdb")
@@ -20,7 +20,12 @@ class QueueAlreadyExists(PSMQError):
     """
 
     def __init__(self, qname: str):
-        super().__init__(f"Queue '{qname}' already exists.")
+        self.qname = qname
+        super().__init__(qname)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"Queue '{self.qname}' already exists."
 
 
 class QueueDoesNotExist(PSMQError):
@@ -29,7 +34,12 @@ class QueueDoesNotExist(PSMQError):
     """
 
     def __init__(self, qname: str):
-        super().__init__(f"Queue '{qname}' does not exist.")
+        self.qname = qname
+        super().__init__(qname)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"Queue '{self.qname}' does not exist."
 
 
 class NoMessageInQueue(PSMQError):
@@ -39,7 +49,12 @@ class NoMessageInQueue(PSMQError):
     """
 
     def __init__(self, qname: str):
-        super().__init__(f"There are no messages in queue '{qname}'.")
+        self.qname = qname
+        super().__init__(qname)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"There are no messages in queue '{self.qname}'."
 
 
 class InvalidQueueName(PSMQError):
@@ -58,7 +73,12 @@ class InvalidCharacter(InvalidQueueName):
     """
 
     def __init__(self, character: str):
-        super().__init__(f"The '{character}' character is not allowed in queue names.")
+        self.character = character
+        super().__init__(character)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"The '{self.character}' character is not allowed in queue names."
 
 
 class QueueNameTooLong(InvalidQueueName):
@@ -69,7 +89,12 @@ class QueueNameTooLong(InvalidQueueName):
     """
 
     def __init__(self, max_length: int):
-        super().__init__(f"The queue name must be shorter than {max_length} characters.")
+        self.max_length = max_length
+        super().__init__(max_length)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"The queue name must be shorter than {self.max_length} characters."
 
 
 class ValueTooLow(ValueError):
@@ -78,7 +103,12 @@ class ValueTooLow(ValueError):
     """
 
     def __init__(self, min_val: Union[int, float]):
-        super().__init__(f"The value must not be lower than {min_val}.")
+        self.min_val = min_val
+        super().__init__(min_val)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"The value must not be lower than {self.min_val}."
 
 
 class ValueTooHigh(ValueError):
@@ -87,7 +117,12 @@ class ValueTooHigh(ValueError):
     """
 
     def __init__(self, max_val: Union[int, float]):
-        super().__init__(f"The value must not be higher than {max_val}.")
+        self.max_val = max_val
+        super().__init__(max_val)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"The value must not be higher than {self.max_val}."
 
 
 class UnserializableMessage(PSMQError):
@@ -96,7 +131,13 @@ class UnserializableMessage(PSMQError):
     """
 
     def __init__(self, message: Any, serializer: str):
-        super().__init__(f"Cannot serialize message `{message!r}` with {serializer}")
+        self.message = message
+        self.serializer = serializer
+        super().__init__(message, serializer)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"Cannot serialize message `{self.message!r}` with {self.serializer}"
 
 
 class UndeserializableMessage(PSMQError):
@@ -105,4 +146,10 @@ class UndeserializableMessage(PSMQError):
     """
 
     def __init__(self, message: bytes, deserializer: str):
-        super().__init__(f"Cannot deserialize message `{message!r}` with {deserializer}")
+        self.message = message
+        self.deserializer = deserializer
+        super().__init__(message, deserializer)
+
+    def __str__(self) -> str:
+        """Return the error message."""
+        return f"Cannot deserialize message `{self.message!r}` with {self.deserializer}"
@@ -0,0 +1,100 @@
+"""Creating and managing queues."""
+
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterator, Optional, Union
+
+from redis import Redis
+
+from psmq import queue_ops
+from psmq.queue import Queue
+from psmq.types import QueueConfiguration
+
+if TYPE_CHECKING:
+    from psmq.serialize import DeserializerFunc, SerializerFunc
+
+
+class QueueManager:
+    """
+    The main entry point for working with queues on a Redis server.
+
+    Args:
+        connection: The Redis connection, with the PSMQ library loaded
+    """
+
+    def __init__(self, connection: Redis):
+        self.connection = connection
+        self._queues: Dict[str, Queue] = {}
+        self._queue_names: Optional[FrozenSet[str]] = None
+
+    def get_queue(
+        self,
+        name: str,
+        default_config: Optional[QueueConfiguration] = None,
+        serializer: Union["SerializerFunc", str, None] = None,
+        deserializer: Union["DeserializerFunc", str, None] = None,
+    ) -> Queue:
+        """
+        Get a queue, creating it if it doesn't exist.
+
+        Queues are cached by name, so asking for the same queue again returns the
+        same :class:`~psmq.queue.Queue` without another trip to Redis. Passing a
+        configuration or serializers builds a new queue with them, which replaces the cached one.
+        The replaced queue is closed, sending any messages waiting from
+        :meth:`~psmq.queue.Queue.push_async`.
+
+        Args:
+            name: The name of the queue
+            default_config: The configuration to use if the queue does not exist
+            serializer: Optional method, or name of a method, to serialize messages
+            deserializer: Optional method, or name of a method, to deserialize messages
+
+        Returns:
+            The queue
+        """
+        if name in self._queues and default_config is None and serializer is None and deserializer is None:
+            return self._queues[name]
+        queue = Queue(self.connection, name, default_config, serializer, deserializer)
+        replaced = self._queues.get(name)
+        if replaced is not None:
+            replaced.close()
+        self._queues[name] = queue
+        if self._queue_names is not None:
+            self._queue_names |= {name}
+        return queue
+
+    def delete_queue(self, name: str) -> None:
+        """
+        Delete a queue and all its messages.
+
+        Args:
+            name: The name of the queue
+        """
+        queue_ops.delete_queue(self.connection, name)
+        self._queues.pop(name, None)
+        if self._queue_names is not None:
+            self._queue_names -= {name}
+
+    def iter_queues(self) -> Iterator[str]:
+        """
+        Iterate over the names of all the queues without loading them all at once.
+
+        Returns:
+            An iterator of queue names
+        """
+        return queue_ops.iter_queues(self.connection)
+
+    def queues(self, refresh: bool = False) -> FrozenSet[str]:
+        """
+        Get the names of all the queues.
+
+        The names are fetched once and then kept up to date as this manager creates and deletes
+        queues. Queues created or deleted elsewhere show up after a refresh.
+
+        Args:
+            refresh: Fetch the names from Redis again instead of using the cached ones
+
+        Returns:
+            The set of queue names
+        """
+        if self._queue_names is None or refresh:
+            self._queue_names = queue_ops.list_queues(self.connection)
+        return self._queue_names
@@ -1,10 +1,13 @@
 """Messages for PSMQ."""
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
-from typing import Any, Optional
+from datetime import datetime
+from typing import Any, Optional, Tuple
 
+from psmq.serialize import SerializedMessage, SerializerFunc, unpack_metadata
+from psmq.utils import DATACLASS_SLOTS
 
-@dataclass
+
+@dataclass(**DATACLASS_SLOTS)
 class ReceivedMessage:
     """A message received from a Queue."""
 
@@ -15,13 +18,13 @@ class ReceivedMessage:
     "The internal message id."
 
     data: Any
-    "The message's contents."
+    "The message's contents, or ``None`` if the message body was empty."
 
-    sent: datetime
-    "Timestamp of when this message was sent/created."
+    sent: int
+    "Timestamp (epoch in milliseconds) of when this message was sent/created."
 
-    first_retrieved: datetime
-    "Timestamp of when this message was first received."
+    first_retrieved: int
+    "Timestamp (epoch in milliseconds) of when this message was first received."
 
     retrieval_count: int
     "The number of times this message has been retrieved."
@@ -29,11 +32,92 @@ class ReceivedMessage:
     ttl: Optional[int] = None
     "The message's time-to-live in seconds."
 
-    metadata: dict = field(default_factory=dict)
+    raw_metadata: bytes = b"\x80"
+    "The msgpack-serialized metadata stored with the message."
+
+    _metadata: Optional[dict] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def metadata(self) -> dict:
+        """
+        Metadata stored with the message, unpacked the first time it is read.
+
+        The send time is in :attr:`sent`, not here.
+        """
+        if self._metadata is None:
+            metadata = unpack_metadata(self.raw_metadata)
+            metadata.pop("sent", None)  # Only messages stored by older versions have it
+            self._metadata = metadata
+        return self._metadata
+
+    @property
+    def sent_dt(self) -> datetime:
+        """The :attr:`sent` timestamp as a ``datetime``."""
+        return datetime.fromtimestamp(self.sent / 1000)
+
+    @property
+    def first_retrieved_dt(self) -> datetime:
+        """The :attr:`first_retrieved` timestamp as a ``datetime``."""
+        return datetime.fromtimestamp(self.first_retrieved / 1000)
+
+    @property
+    def expires_ms(self) -> Optional[int]:
+        """
+        Timestamp (epoch in milliseconds) of when this message will expire, calculated from the message's `ttl`.
+        """
+        return None if self.ttl is None else self.sent + self.ttl * 1000
 
     @property
     def expires(self) -> Optional[datetime]:
         """
         Timestamp of when this message will expire. This is calculated from the message's `ttl`.
         """
-        return None if self.ttl is None else self.sent + timedelta(seconds=self.ttl)
+        expires_ms = self.expires_ms
+        return None if expires_ms is None else datetime.fromtimestamp(expires_ms / 1000)
+
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
+class CachedMessage:
+    """
+    A message whose serialized form is kept after the first time it is sent.
+
+    Pushing the same ``CachedMessage`` again, for example on a retry or to another queue,
+    reuses the bytes instead of serializing ``data`` again. The class is frozen so the cache
+    can't go stale; make a new ``CachedMessage`` to send different data.
+    """
+
+    data: Any
+    "The message's contents."
+
+    _serialized: Optional[Tuple[SerializerFunc, bytes]] = field(default=None, init=False, repr=False, compare=False)
+    "The serializer last used for this message and the bytes it produced."
+
+    def serialize(self, serializer: SerializerFunc) -> bytes:
+        """
+        Serialize the message, reusing the cached bytes if they came from the same serializer.
+
+        Args:
+            serializer: The serializer to use
+
+        Returns:
+            The serialized message
+        """
+        if self._serialized is not None and self._serialized[0] is serializer:
+            return self._serialized[1]
+        serialized = serializer(self.data)
+        object.__setattr__(self, "_serialized", (serializer, serialized))
+        return serialized
+
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
+class RawMessage:
+    """
+    A message that is already serialized, sent as it is instead of through the queue's serializer.
+
+    Plain ``bytes`` are a valid message for serializers such as msgpack, so they are always
+    serialized. Wrap a payload in ``RawMessage`` to send it unchanged. It must still be readable
+    by the deserializer of whoever receives it.
+    """
+
+    data: SerializedMessage
+    "The serialized message. ``bytes``, ``bytearray`` and ``memoryview`` are sent without a copy."
@@ -11,7 +11,8 @@
 --   FIELDS
 --
 --   {msgid}: The message
---   {msgid}:metadata: The metadata for a single message. It is a messagpack serialized hash map
+--   {msgid}:metadata: The metadata for a single message. It is a messagpack serialized hash map, stored as the
+--     client packed it. The send time isn't part of it, since it is read from the message id.
 --   {msgid}:rc: The receive counter for a single message. Will be incremented on each receive.
 --   {msgid}:fr: The timestamp when this message was received for the first time. Will be created on the first receive.
 --   totalsent: The total number of messages sent to this queue.
@@ -62,14 +63,18 @@ local function b36encode(keys)
         return alphabet[num + 1]
     end
 
-    -- Process large numbers now
-    local result = ""
+    -- Process large numbers now. The digits come out least significant first, so they are
+    -- collected in a table, reversed in place and joined once, instead of building a new string per digit.
+    local digits = {}
     while num ~= 0 do
-        local i = num % 36
-        result = alphabet[i + 1] .. result
+        digits[#digits + 1] = alphabet[num % 36 + 1]
         num = math.floor(num / 36)
     end
-    return result
+    local n = #digits
+    for i = 1, math.floor(n / 2) do
+        digits[i], digits[n - i + 1] = digits[n - i + 1], digits[i]
+    end
+    return table.concat(digits)
 end
 
 redis.register_function("b36encode", b36encode)
@@ -96,8 +101,9 @@ redis.register_function("get_time", get_time)
 
 
 -- make a message id
+-- The id starts with the given microsecond timestamp, or the server's time if there isn't one.
 local function make_message_id(keys)
-    local timestamp_microsec = keys[1]
+    local timestamp_microsec = keys[1] or get_time().microsec
     local message_id = { b36encode({ timestamp_microsec }) }
     for i = 2, 23 do
         message_id[i] = alphabet[math.random(1, 36)]
@@ -184,12 +190,8 @@ end
 
 redis.register_function("delete_queue", delete_queue)
 
--- Get queue info.
-local function get_queue_info(keys)
-    local queue_name = keys[1]
-
-    create_queue({ queue_name })
-
+-- Read a queue's info without creating the queue, or nil if it doesn't exist.
+local function read_queue_info(queue_name)
     local queue_info_key = queue_name .. ":Q"
     local queue_info_keys = {
         "vt",
@@ -202,6 +204,9 @@ local function get_queue_info(keys)
     }
 
     local raw_info = redis.call("HMGET", queue_info_key, unpack(queue_info_keys))
+    if not raw_info[1] then
+        return nil
+    end
     local queue_info = {}
     for i, v in ipairs(raw_info) do
         queue_info[queue_info_keys[i]] = tonumber(v)
@@ -217,18 +222,57 @@ local function get_queue_info(keys)
     return queue_info
 end
 
+-- Get queue info, creating the queue if it doesn't exist.
+local function get_queue_info(keys)
+    local queue_name = keys[1]
+
+    create_queue({ queue_name })
+
+    return read_queue_info(queue_name)
+end
+
+-- Convert the queue info into a positional array:
+-- vt, delay, maxsize, created, modified, totalrecv, totalsent, msgs, hiddenmsgs
+local function queue_info_for_redis(queue_info)
+    return {
+        queue_info.vt,
+        queue_info.delay,
+        queue_info.maxsize,
+        queue_info.created,
+        queue_info.modified,
+        queue_info.totalrecv,
+        queue_info.totalsent,
+        queue_info.msgs,
+        queue_info.hiddenmsgs
+    }
+end
+
 local function get_queue_info_for_redis(keys)
-    local queue_info = get_queue_info(keys)
-    local unp = {}
-    for k, v in pairs(queue_info) do
-        unp[#unp + 1] = k
-        unp[#unp + 1] = v
-    end
-    return unp
+    return queue_info_for_redis(get_queue_info(keys))
 end
 
 redis.register_function("get_queue_info", get_queue_info_for_redis)
 
+-- Get the info of an existing queue without writing anything, or nil if the queue doesn't exist.
+-- It is flagged no-writes, so it can be called with FCALL_RO and served by a replica.
+local function peek_queue_info(keys)
+    local queue_info = read_queue_info(keys[1])
+    if queue_info == nil then
+        return nil
+    end
+    return queue_info_for_redis(queue_info)
+end
+
+redis.register_function{ function_name = "peek_queue_info", callback = peek_queue_info, flags = { "no-writes" } }
+
+-- Create a queue if it doesn't exist, and get its info in the same call.
+local function create_or_get_queue(keys)
+    create_queue(keys)
+    return get_queue_info_for_redis({ keys[1] })
+end
+
+redis.register_function("create_or_get_queue", create_or_get_queue)
+
 -- Set queue visibility timeout
 local function set_queue_viz_timeout(keys)
     local queue_name = keys[1]
@@ -269,110 +313,245 @@ end
 
 redis.register_function("set_queue_max_size", set_queue_max_size)
 
---
--- Message functions
---
+-- Set several queue attributes at once.
+-- Attributes that are missing or empty are left unchanged.
+local function set_queue_attributes(keys)
+    local queue_name = keys[1]
+    local viz_timeout = tonumber(keys[2])
+    local initial_delay = tonumber(keys[3])
+    local max_size = tonumber(keys[4])
 
--- Send a message to a queue.
-local function push_message(keys)
-    local queue_key = keys[1]
-    local message = keys[2]
-    local delay = tonumber(keys[3]) -- If delay is nil, the queue's initial delay will be used.
-    local serialized_metadata = keys[4] or "\128" -- 0x80 or 128 is the msgpack serialization of an empty hash
-    local metadata = deserialize_metadata({ serialized_metadata })
+    create_queue({ queue_name })
 
-    -- Create the queue in case it doesn't exist.
-    create_queue({ queue_key })
+    local attributes = {}
+    if viz_timeout ~= nil then
+        attributes[#attributes + 1] = "vt"
+        attributes[#attributes + 1] = viz_timeout
+    end
+    if initial_delay ~= nil then
+        attributes[#attributes + 1] = "delay"
+        attributes[#attributes + 1] = initial_delay
+    end
+    if max_size ~= nil then
+        attributes[#attributes + 1] = "maxsize"
+        attributes[#attributes + 1] = max_size
+    end
+    if #attributes == 0 then
+        return 0
+    end
+
+    local queue_info_key = queue_name .. ":Q"
+    redis.call("HSET", queue_info_key, unpack(attributes))
+    return #attributes / 2
+end
 
-    -- Get the queue delay.
-    local queue_info = get_queue_info({ queue_key })
-    assert(type(queue_info.delay) ~= "nil", "Queue delay is nil")
+redis.register_function("set_queue_attributes", set_queue_attributes)
 
-    if delay == nil then
-        delay = queue_info.delay
-    elseif delay < 0 then
-        delay = queue_info.delay
+--
+-- Message functions
+--
+
+-- Get the delay, in seconds, to use for new messages.
+-- A missing or negative delay means the queue's initial delay.
+-- Only the delay field is read, and only when it is needed, instead of the whole queue info.
+local function get_push_delay(queue_key, delay_arg)
+    local delay = tonumber(delay_arg)
+    if delay == nil or delay < 0 then
+        delay = tonumber(redis.call("HGET", queue_key .. ":Q", "delay"))
+        assert(type(delay) ~= "nil", "Queue delay is nil")
     end
+    return delay
+end
 
+-- Add one message to a queue and return its id.
+local function add_message(queue_key, message, delay, packed_metadata, time, microsec)
     local queue_info_key = queue_key .. ":Q"
-    local time = get_time()
-    local message_id = make_message_id({ time.microsec })
+    local message_id = make_message_id({ microsec })
     local message_score = time.millisec + (delay * 1000)
     local message_metadata_key = message_id .. ":metadata"
-    metadata["sent"] = time.millisec / 1000
 
     -- Add the message to the queue.
     redis.call("ZADD", queue_key, message_score, message_id)
 
     -- Add the message to the queue info hash.
-    redis.call("HMSET", queue_info_key, message_id, message, message_metadata_key, serialize_metadata({ metadata }))
+    redis.call("HMSET", queue_info_key, message_id, message, message_metadata_key, packed_metadata)
+
+    return message_id
+end
+
+-- Send a message to a queue.
+local function push_message(keys)
+    local queue_key = keys[1]
+    local message = keys[2]
+    local serialized_metadata = keys[4] or "\128" -- 0x80 or 128 is the msgpack serialization of an empty hash
+
+    -- Create the queue in case it doesn't exist.
+    create_queue({ queue_key })
+
+    -- If delay is nil, the queue's initial delay will be used.
+    local delay = get_push_delay(queue_key, keys[3])
+    local time = get_time()
+    local message_id = add_message(queue_key, message, delay, serialized_metadata, time, time.microsec)
 
     -- Increase the total message count for the queue.
-    redis.call("HINCRBY", queue_info_key, "totalsent", 1)
+    redis.call("HINCRBY", queue_key .. ":Q", "totalsent", 1)
 
     return message_id
 end
 
 redis.register_function("push_message", push_message)
 
-
--- Get the next message from the queue.
-local function get_message(keys)
+-- Send several messages to a queue in one call.
+-- keys: queue name, delay, serialized metadata, then the messages.
+-- Every message shares the delay and metadata. The ids are made from consecutive
+-- microseconds, so they keep the order the messages were given in.
+local function push_messages(keys)
     local queue_key = keys[1]
-    local time = get_time()
-    local queue_info = get_queue_info({ queue_key })
-    local vt = tonumber(keys[2]) or queue_info.vt
-    assert(type(vt) == "number", "Visibility timeout is not a number: " .. type(vt) .. " " .. vt)
-    local viz_timeout = vt * 1000
+    local serialized_metadata = keys[3]
+    if serialized_metadata == nil or serialized_metadata == "" then
+        serialized_metadata = "\128"
+    end
+
+    create_queue({ queue_key })
+
     local queue_info_key = queue_key .. ":Q"
-    local msg = redis.call("ZRANGE", queue_key, "-inf", time.millisec, "BYSCORE", "LIMIT", "0", "1")
+    local delay = get_push_delay(queue_key, keys[2])
+    local time = get_time()
+    local message_score = time.millisec + (delay * 1000)
 
-    if #msg == 0 then
-        return {}
+    -- The messages are written with one ZADD and one HSET per group, instead of two commands
+    -- per message. The groups keep the arguments well within what unpack can pass.
+    local message_ids = {}
+    local scores_and_ids = {}
+    local fields_and_values = {}
+    for i = 4, #keys do
+        local message_id = make_message_id({ time.microsec + i - 4 })
+        message_ids[#message_ids + 1] = message_id
+        scores_and_ids[#scores_and_ids + 1] = message_score
+        scores_and_ids[#scores_and_ids + 1] = message_id
+        fields_and_values[#fields_and_values + 1] = message_id
+        fields_and_values[#fields_and_values + 1] = keys[i]
+        fields_and_values[#fields_and_values + 1] = message_id .. ":metadata"
+        fields_and_values[#fields_and_values + 1] = serialized_metadata
+        if #scores_and_ids >= 1000 or i == #keys then
+            redis.call("ZADD", queue_key, unpack(scores_and_ids))
+            redis.call("HSET", queue_info_key, unpack(fields_and_values))
+            scores_and_ids = {}
+            fields_and_values = {}
+        end
     end
 
-    local message_id = msg[1]
+    redis.call("HINCRBY", queue_info_key, "totalsent", #message_ids)
+
+    return message_ids
+end
+
+redis.register_function("push_messages", push_messages)
+
+
+-- Mark a visible message as received and return its fields.
+-- The caller adds the received messages to the queue's totalrecv count.
+local function receive_message(queue_key, message_id, viz_timeout, time)
+    local queue_info_key = queue_key .. ":Q"
     local message_rc_key = message_id .. ":rc"  -- rc = receive count
     local message_fr_key = message_id .. ":fr"  -- fr = first received
     local message_metadata_key = message_id .. ":metadata"
 
     -- Increase the score of the message by viz_timeout.
 
-    redis.call("ZADD", queue_key, "INCR", viz_timeout, msg[1])
-
-    -- increment the total received count for the queue
-    redis.call("HINCRBY", queue_info_key, "totalrecv", 1)
+    redis.call("ZADD", queue_key, "INCR", viz_timeout, message_id)
 
-    -- get the message and increment the receive count
-    local msg_info = redis.call("HMGET", queue_info_key, message_id, message_metadata_key)
+    -- get the message, with its first received time, and increment the receive count
+    local msg_info = redis.call("HMGET", queue_info_key, message_id, message_metadata_key, message_fr_key)
     local rc = redis.call("HINCRBY", queue_info_key, message_rc_key, 1)
 
-    local output = { msg_id = message_id, msg_body = msg_info[1], rc = rc, metadata = msg_info[2] }
+    -- The id starts with the base-36 microsecond timestamp it was sent at, followed by 22 random characters.
+    local sent = math.floor(tonumber(string.sub(message_id, 1, #message_id - 22), 36) / 1000)
+
+    local output = { msg_id = message_id, msg_body = msg_info[1], rc = rc, sent = sent, metadata = msg_info[2] }
 
     -- if this is the first time receiving the message, record the timestamp as the first received
     if rc == 1 then
         redis.call("HSET", queue_info_key, message_fr_key, time.millisec)
         output["fr"] = time.millisec
     else
-        local fr = redis.call("HGET", queue_info_key, message_fr_key)
-        output["fr"] = fr
+        output["fr"] = tonumber(msg_info[3])
     end
 
     return output
 end
 
-local function get_message_for_redis(keys)
-    local queue_info = get_message(keys)
-    local unp = {}
-    for k, v in pairs(queue_info) do
-        unp[#unp + 1] = k
-        unp[#unp + 1] = v
+-- Get the visibility timeout in milliseconds, from the argument or the queue's settings.
+-- The queue is created if it doesn't exist, but only its vt field is read.
+local function get_viz_timeout(queue_key, vt_arg)
+    create_queue({ queue_key })
+    local vt = tonumber(vt_arg) or tonumber(redis.call("HGET", queue_key .. ":Q", "vt"))
+    assert(type(vt) == "number", "Visibility timeout is not a number: " .. type(vt))
+    return vt * 1000
+end
+
+-- Get the next message from the queue.
+local function get_message(keys)
+    local queue_key = keys[1]
+    local time = get_time()
+    local viz_timeout = get_viz_timeout(queue_key, keys[2])
+    local msg = redis.call("ZRANGE", queue_key, "-inf", time.millisec, "BYSCORE", "LIMIT", "0", "1")
+
+    if #msg == 0 then
+        return {}
+    end
+
+    redis.call("HINCRBY", queue_key .. ":Q", "totalrecv", 1)
+    return receive_message(queue_key, msg[1], viz_timeout, time)
+end
+
+-- Reply with a message as a positional array:
+-- msg_id, msg_body, rc, fr, sent, metadata
+-- or an empty array if there is no message.
+local function message_for_redis(message)
+    if next(message) == nil then
+        return {}
     end
-    return unp
+    return { message.msg_id, message.msg_body, message.rc, message.fr, message.sent, message.metadata }
+end
+
+local function get_message_for_redis(keys)
+    return message_for_redis(get_message(keys))
 end
 
 redis.register_function("get_message", get_message_for_redis)
 
+-- Get up to `count` visible messages from the queue in one call.
+-- The reply is the messages' positional arrays (msg_id, msg_body, rc, fr, sent, metadata) concatenated.
+local function get_messages(keys)
+    local queue_key = keys[1]
+    local count = tonumber(keys[2]) or 1
+    -- ZRANGE treats a negative LIMIT count as no limit, which would receive the whole queue.
+    if count < 1 then
+        return redis.error_reply("ERR Count must be a positive number.")
+    end
+    local time = get_time()
+    local viz_timeout = get_viz_timeout(queue_key, keys[3])
+    local msgs = redis.call("ZRANGE", queue_key, "-inf", time.millisec, "BYSCORE", "LIMIT", "0", count)
+
+    local output = {}
+    if #msgs > 0 then
+        redis.call("HINCRBY", queue_key .. ":Q", "totalrecv", #msgs)
+    end
+    for _, message_id in ipairs(msgs) do
+        local message = receive_message(queue_key, message_id, viz_timeout, time)
+        output[#output + 1] = message.msg_id
+        output[#output + 1] = message.msg_body
+        output[#output + 1] = message.rc
+        output[#output + 1] = message.fr
+        output[#output + 1] = message.sent
+        output[#output + 1] = message.metadata
+    end
+    return output
+end
+
+redis.register_function("get_messages", get_messages)
+
 
 -- Delete a message from the queue.
 local function delete_message(keys)
@@ -408,13 +587,38 @@ local function pop_message(keys)
 end
 
 local function pop_message_for_redis(keys)
-    local queue_info = pop_message(keys)
-    local unp = {}
-    for k, v in pairs(queue_info) do
-        unp[#unp + 1] = k
-        unp[#unp + 1] = v
-    end
-    return unp
+    return message_for_redis(pop_message(keys))
 end
 
 redis.register_function("pop_message", pop_message_for_redis)
+
+
+-- Pop up to `count` messages from the queue in one call.
+-- The reply has the same layout as get_messages.
+local function pop_messages(keys)
+    local queue_key = keys[1]
+    local queue_info_key = queue_key .. ":Q"
+    local output = get_messages({ queue_key, keys[2] })
+
+    -- The messages are deleted with one ZREM and one HDEL per group, instead of two commands
+    -- per message. The groups keep the arguments well within what unpack can pass.
+    local message_ids = {}
+    local fields = {}
+    for i = 1, #output, 6 do
+        local message_id = output[i]
+        message_ids[#message_ids + 1] = message_id
+        fields[#fields + 1] = message_id
+        fields[#fields + 1] = message_id .. ":rc"
+        fields[#fields + 1] = message_id .. ":fr"
+        fields[#fields + 1] = message_id .. ":metadata"
+        if #message_ids >= 500 or i + 6 > #output then
+            redis.call("ZREM", queue_key, unpack(message_ids))
+            redis.call("HDEL", queue_info_key, unpack(fields))
+            message_ids = {}
+            fields = {}
+        end
+    end
+    return output
+end
+
+redis.register_function("pop_messages", pop_messages)
@@ -1,64 +1,28 @@
 """Queues and message handling."""
 
-from dataclasses import dataclass
-from typing import Any, List, Optional
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, List, Optional, Type, Union
 
 from redis import Redis
 
 from psmq import queue_ops
+from psmq.async_producer import BatchedProducer
 from psmq.exceptions import NoMessageInQueue, UndeserializableMessage, UnserializableMessage
-from psmq.message import ReceivedMessage
-from psmq.serialize import DeserializerFunc, SerializerFunc, default_deserializer, default_serializer
+from psmq.message import CachedMessage, RawMessage, ReceivedMessage
+from psmq.serialize import (
+    DeserializerFunc,
+    SerializedMessage,
+    SerializerFunc,
+    default_deserializer,
+    default_serializer,
+    get_serializers,
+)
+from psmq.types import QueueConfiguration, QueueMetadata
 from psmq.validation import validate_queue_name
 
-
-@dataclass(frozen=True)
-class QueueConfiguration:
-    """Configuration for a queue."""
-
-    visibility_timeout: int = 60
-    """The length of time, in seconds, that a message received from a queue will
-    be invisible to other receiving components when they ask to receive messages."""
-
-    initial_delay: int = 0
-    "The time in seconds that the delivery of all new messages in the queue will be delayed"
-
-    max_size: int = 65565
-    "The maximum size of a message in bytes"
-
-    retries: int = 5
-    "The number of times to retry a message before giving up."
-
-    ttl: Optional[int] = None
-    "The optional time to live for a message in milliseconds."
-
-
-@dataclass(frozen=True)
-class QueueMetadata:
-    """Metadata for a queue."""
-
-    totalrecv: int
-    "Total number of messages received from (taken off of) the queue"
-
-    totalsent: int
-    "Total number of messages sent to this queue"
-
-    created: int
-    "Timestamp (epoch in seconds) when the queue was created"
-
-    modified: int
-    "Timestamp (epoch in seconds) when the queue was last modified"
-
-    msgs: int
-    "Current number of messages in the queue"
-
-    hiddenmsgs: int
-    """
-    Current number of hidden / not visible messages.
-
-    A message typically is hidden while "in flight". This number can be a good measurement for
-    how many messages are currently being processed.
-    """
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from types import TracebackType
 
 
 class Queue:
@@ -69,8 +33,13 @@ class Queue:
         connection: The root connection object
         name: The name of the queue
         default_config: The default configuration to use if the queue does not exist
-        serializer: Optional method to serialize messages
-        deserializer: Optional method to deserialize messages
+        serializer: Optional method to serialize messages, or the name of one in
+            :data:`psmq.serialize.SERIALIZERS`. A name also sets the matching deserializer
+            if ``deserializer`` is not given.
+        deserializer: Optional method to deserialize messages, or the name of one in
+            :data:`psmq.serialize.SERIALIZERS`
+        lazy: Don't contact Redis until the queue's configuration or metadata is needed.
+            Use this when the queue is known to exist already.
     """
 
     def __init__(
@@ -78,42 +47,85 @@ class Queue:
         connection: Redis,
         name: str,
         default_config: Optional[QueueConfiguration] = None,
-        serializer: Optional["SerializerFunc"] = None,
-        deserializer: Optional["DeserializerFunc"] = None,
+        serializer: Union["SerializerFunc", str, None] = None,
+        deserializer: Union["DeserializerFunc", str, None] = None,
+        lazy: bool = False,
     ):
         validate_queue_name(name, raise_on_error=True)
         self.connection = connection
         self.name = name
-        if default_config:
-            queue_ops.create_queue(
-                connection,
-                name,
-                default_config.visibility_timeout,
-                default_config.initial_delay,
-                default_config.max_size,
-            )
-        else:
-            queue_ops.create_queue(connection, name)
-        q_info = queue_ops.get_queue_info(self.connection, name)
-        self._configuration = q_info["config"]
-        self._metadata = q_info["metadata"]
+        self._default_config = default_config or QueueConfiguration()
+        if not lazy:
+            self._load_info()
+        if isinstance(serializer, str):
+            serializer, paired_deserializer = get_serializers(serializer)
+            deserializer = deserializer or paired_deserializer
+        if isinstance(deserializer, str):
+            deserializer = get_serializers(deserializer)[1]
         self.serializer = serializer or default_serializer
         self.deserializer = deserializer or default_deserializer
-
-    def metadata(self) -> QueueMetadata:
+        self._producer: Optional[BatchedProducer] = None
+
+    def _load_info(self) -> dict:
+        """Create the queue if needed and cache its configuration and metadata."""
+        q_info = queue_ops.create_or_get_queue(
+            self.connection,
+            self.name,
+            self._default_config.visibility_timeout,
+            self._default_config.initial_delay,
+            self._default_config.max_size,
+        )
+        self.__dict__["_configuration"] = q_info["config"]
+        self.__dict__["_metadata"] = q_info["metadata"]
+        return q_info
+
+    @cached_property
+    def _configuration(self) -> QueueConfiguration:
+        """The queue's configuration, fetched from Redis the first time it is needed."""
+        return self._load_info()["config"]
+
+    @cached_property
+    def _metadata(self) -> QueueMetadata:
+        """The queue's metadata as of the last fetch from Redis."""
+        return self._load_info()["metadata"]
+
+    def invalidate(self) -> None:
+        """Forget the cached configuration and metadata, so they are fetched again when next needed."""
+        self.__dict__.pop("_configuration", None)
+        self.__dict__.pop("_metadata", None)
+
+    def _forget_metadata(self) -> None:
+        """Forget the cached metadata after an operation that changes it."""
+        self.__dict__.pop("_metadata", None)
+
+    def metadata(self, cached: bool = False) -> QueueMetadata:
         """
         Get the metadata for the queue.
 
+        Args:
+            cached: Reuse the metadata from the last fetch, unless this queue object has pushed,
+                received or deleted a message since. The cached counts miss changes made by other
+                clients, and hidden messages becoming visible again.
+
         Returns:
             The queue metadata
         """
-        q_info = queue_ops.get_queue_info(self.connection, self.name)
-        return q_info["metadata"]
+        if not cached or "_metadata" not in self.__dict__:
+            q_info = queue_ops.get_queue_info(self.connection, self.name)
+            self.__dict__["_configuration"] = q_info["config"]
+            self.__dict__["_metadata"] = q_info["metadata"]
+        return self._metadata
 
-    def serialize(self, message: Any) -> bytes:
+    def serialize(self, message: Any) -> SerializedMessage:
         """
         Serialize a message.
 
+        A :class:`~psmq.message.CachedMessage` is only serialized the first time it is sent
+        with this queue's serializer.
+
+        A :class:`~psmq.message.RawMessage` is taken to be serialized already, and its data is sent
+        as it is, without a copy. It must still be readable by this queue's deserializer.
+
         Args:
             message: The message to serialize
 
@@ -123,12 +135,36 @@ class Queue:
         Returns:
             The serialized message
         """
+        if type(message) is RawMessage:
+            return message.data
         try:
+            if type(message) is CachedMessage:
+                return message.serialize(self.serializer)
             return self.serializer(message)
         except Exception as e:  # NOQA: BLE001
             # TODO: This might be a place to provide a hook or configuration for error handling
             raise UnserializableMessage(message, self.serializer.__name__) from e
 
+    def _serialize_many(self, messages: List[Any]) -> List[SerializedMessage]:
+        """
+        Serialize a batch of messages, calling the serializer directly for each one.
+
+        The whole batch shares one ``try``. If anything fails, the batch is serialized again
+        through :meth:`serialize` so the error names the message that caused it.
+        """
+        serializer = self.serializer
+        try:
+            return [
+                message.data
+                if type(message) is RawMessage
+                else message.serialize(serializer)
+                if type(message) is CachedMessage
+                else serializer(message)
+                for message in messages
+            ]
+        except Exception:  # NOQA: BLE001
+            return [self.serialize(message) for message in messages]
+
     def deserialize(self, message: bytes) -> Any:
         """
         Deserialize a message.
@@ -163,11 +199,20 @@ class Queue:
             The message id
         """
         serialized = self.serialize(message)
-        return queue_ops.push_message(self.connection, self.name, serialized, delay=delay, ttl=ttl)
+        msg_id = queue_ops.push_message(self.connection, self.name, serialized, delay=delay, ttl=ttl)
+        self._forget_metadata()
+        return msg_id.decode("utf8")
 
-    def push_many(self, messages: List[Any], delay: Optional[int] = None, ttl: Optional[int] = None) -> list:
+    def push_many(
+        self,
+        messages: List[Any],
+        delay: Optional[int] = None,
+        ttl: Optional[int] = None,
+        chunk_size: Optional[int] = 1000,
+        decode: bool = True,
+    ) -> list:
         """
-        Send multiple messages, all pipelined together.
+        Send multiple messages, with one call to Redis per chunk.
 
         Args:
             messages: The messages to send
@@ -175,18 +220,81 @@ class Queue:
                 the delivery of the message will be delayed. Allowed values: 0-9999999
                 (around 115 days)
             ttl: The time to live for the message in milliseconds. Allowed values: 0-9999999
+            chunk_size: The most messages to send in one call. ``None`` sends them all at once.
+            decode: Return the ids as ``str``. Pass ``False`` to get the raw ``bytes`` and skip decoding.
 
         Returns:
             All message ids
         """
-        tx = self.connection.pipeline(transaction=True)
-        for message in messages:
-            serialized = self.serialize(message)
-            queue_ops.push_message(tx, self.name, serialized, delay=delay, ttl=ttl)
-        message_ids = tx.execute()
-        return [msg_id.decode("utf-8") for msg_id in message_ids]
-
-    def delete(self, msg_id: str) -> None:
+        serialized = self._serialize_many(messages)
+        msg_ids = queue_ops.push_messages(
+            self.connection, self.name, serialized, delay=delay, ttl=ttl, chunk_size=chunk_size
+        )
+        self._forget_metadata()
+        return [msg_id.decode("utf8") for msg_id in msg_ids] if decode else msg_ids
+
+    def push_async(self, message: Any, delay: Optional[int] = None) -> "Future[str]":
+        """
+        Send a message without waiting for Redis.
+
+        The message is serialized straight away and sent from a background thread, batched
+        with other messages pushed around the same time. Messages are sent in the order
+        they are pushed. Call :meth:`flush` to wait for them, or :meth:`close` to also stop the
+        thread, before shutting down.
+
+        Args:
+            message: The message to send
+            delay: The time in seconds that
+                the delivery of the message will be delayed. Allowed values: 0-9999999
+                (around 115 days)
+
+        Returns:
+            A future that resolves to the message id
+        """
+        serialized = self.serialize(message)
+        if self._producer is None:
+            self._producer = BatchedProducer(self.connection, self.name)
+        return self._producer.push(serialized, delay=delay)
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait until all messages sent with :meth:`push_async` are in Redis.
+
+        Args:
+            timeout: The most seconds to wait, or ``None`` to wait until they are sent
+        """
+        if self._producer is not None:
+            self._producer.flush(timeout)
+            self._forget_metadata()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Send the messages waiting from :meth:`push_async` and stop its background thread.
+
+        The queue can still be used afterwards. Another :meth:`push_async` starts a new thread.
+
+        Args:
+            timeout: The most seconds to wait for the thread, or ``None`` to wait until it stops
+        """
+        if self._producer is not None:
+            self._producer.close(timeout)
+            self._producer = None
+            self._forget_metadata()
+
+    def __enter__(self) -> "Queue":
+        """Use the queue, closing it when the block ends."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional["TracebackType"],
+    ) -> None:
+        """Close the queue."""
+        self.close()
+
+    def delete(self, msg_id: Union[bytes, str]) -> None:
         """
         Delete a message if it exists.
 
@@ -194,6 +302,7 @@ class Queue:
             msg_id: The ID of the message to delete
         """
         queue_ops.delete_message(self.connection, self.name, msg_id)
+        self._forget_metadata()
 
     def get(self, visibility_timeout: Optional[int] = None, raise_on_empty: bool = False) -> Optional[ReceivedMessage]:
         """
@@ -211,15 +320,79 @@ class Queue:
         Returns:
             The message if available, or ``None``
         """
-        msg = queue_ops.get_message(self.connection, self.name, visibility_timeout=visibility_timeout)
+        msg = queue_ops.get_message(self.connection, self.name, visibility_timeout=visibility_timeout, decode=False)
+        self._forget_metadata()
         if msg is None and raise_on_empty:
             raise NoMessageInQueue(self.name)
         elif msg is None:
             return None
         else:
-            msg.data = self.deserialize(msg.data) if msg.data else msg.data
+            if msg.data is not None:
+                msg.data = self.deserialize(msg.data)
             return msg
 
+    def get_many(self, count: int, visibility_timeout: Optional[int] = None) -> List[ReceivedMessage]:
+        """
+        Receive up to ``count`` messages in one round trip.
+
+        Args:
+            count: The maximum number of messages to receive
+            visibility_timeout: optional (Default: queue settings) The length of time, in seconds,
+                that the received messages will be invisible to others. Allowed values:
+                0-9999999 (around 115 days)
+
+        Returns:
+            The messages received, oldest first. It is empty if there are no messages.
+        """
+        msgs = queue_ops.get_messages(
+            self.connection, self.name, count, visibility_timeout=visibility_timeout, decode=False
+        )
+        self._forget_metadata()
+        return self._deserialize_messages(msgs)
+
+    def pop_many(self, count: int) -> List[ReceivedMessage]:
+        """
+        Receive up to ``count`` messages and delete them, in two round trips.
+
+        The messages are received as with :meth:`get_many`, and only the ones that deserialize are
+        deleted. A message that can't be deserialized stays on the queue, hidden for the visibility
+        timeout as after a failed :meth:`pop`, so it doesn't take the rest of the batch with it.
+
+        Args:
+            count: The maximum number of messages to receive
+
+        Returns:
+            The messages deserialized and deleted, oldest first. It is empty if there are no messages.
+        """
+        msgs = queue_ops.get_messages(self.connection, self.name, count, decode=False)
+        popped = []
+        for msg in msgs:
+            if msg.data is not None:
+                try:
+                    msg.data = self.deserialize(msg.data)
+                except UndeserializableMessage:
+                    continue
+            popped.append(msg)
+        queue_ops.delete_messages(self.connection, self.name, [msg.message_id for msg in popped])
+        self._forget_metadata()
+        return popped
+
+    def _deserialize_messages(self, msgs: List[ReceivedMessage]) -> List[ReceivedMessage]:
+        """
+        Replace the data of each message with its deserialized value.
+
+        Like :meth:`_serialize_many`, the deserializer is called directly under one ``try``,
+        and the batch is retried through :meth:`deserialize` to report a failure.
+        """
+        deserializer = self.deserializer
+        try:
+            data = [deserializer(msg.data) if msg.data is not None else None for msg in msgs]
+        except Exception:  # NOQA: BLE001
+            data = [self.deserialize(msg.data) if msg.data is not None else None for msg in msgs]
+        for msg, value in zip(msgs, data):
+            msg.data = value
+        return msgs
+
     def pop(self, raise_on_empty: bool = False) -> Optional[ReceivedMessage]:
         """
         Receive a message and delete it immediately.
@@ -234,41 +407,3 @@ class Queue:
         if msg:
             self.delete(msg.message_id)
         return msg
-
-
-# def handle_message_result(result: tuple) -> Message:
-#     """
-#     Handle a message received from the queue and format it properly.
-#
-#     Args:
-#         result: The raw message data received from Redis
-#
-#     Returns:
-#         A populated Message object
-#     """
-#     message_id, message, rc, fr = result
-#     message = decode_message(message)
-#     sent = base36decode(message_id[:10])
-#     return Message(message_id, message, sent, fr, rc)
-
-
-# def make_message_id(usec: int) -> str:
-#     """
-#     Need to create a unique id based on the redis timestamp and a random number.
-#
-#     The first part is the Redis time base-36 encoded which lets redis order the messages correctly
-#     even when they are in the same millisecond.
-#
-#     Args:
-#         usec: The Redis timestamp in microseconds as an integer
-#
-#     Returns:
-#         A time-sortable, unique message id
-#     """
-#     import random
-#
-#     charset = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-#
-#     msg_id = [random.choice(charset) for _ in range(22)]  # nosec
-#     msg_id.insert(0, base36encode(usec))
-#     return "".join(msg_id)
@@ -1,18 +1,60 @@
 """Queue Operations for Redis connections."""
 
-from datetime import datetime
-from typing import Optional, Union
+from functools import wraps
+from typing import Any, Callable, FrozenSet, Iterable, Iterator, List, Optional, Sequence, TypeVar, Union, cast
 
-import umsgpack
+from redis import ResponseError
 from redis.client import Pipeline, Redis
 
+from psmq.connection import reload_library
 from psmq.message import ReceivedMessage
-from psmq.utils import list_to_dict
-from psmq.validation import validate_queue_name
+from psmq.serialize import SerializedMessage, pack_metadata
+from psmq.types import QueueConfiguration, QueueMetadata
+from psmq.utils import _decode
+from psmq.validation import validate_int, validate_queue_name
 
 QUEUE_SET_KEY = "QUEUES"
 
+EMPTY_METADATA = pack_metadata({})
+"""The serialized form of empty message metadata."""
 
+# Prebuilt FCALL command prefixes for the functions that send and receive messages. Passing them
+# straight to ``execute_command`` skips the ``fcall`` wrapper on every call.
+_PUSH_MESSAGE = ("FCALL", "push_message", 4)
+_GET_MESSAGE = ("FCALL", "get_message", 2)
+_GET_MESSAGES = ("FCALL", "get_messages", 3)
+_POP_MESSAGES = ("FCALL", "pop_messages", 2)
+_DELETE_MESSAGE = ("FCALL", "delete_message", 2)
+
+MESSAGE_FIELDS = ("msg_id", "msg_body", "rc", "fr", "sent", "metadata")
+"""The order of the fields in a message reply from the Lua library."""
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _reload_library_if_missing(func: _F) -> _F:
+    """
+    Reload the PSMQ library and retry once if the server doesn't have it.
+
+    The library is only loaded once per connection pool, so a server that lost it would fail every
+    call until the process restarted. Redis rejects a missing function before running anything,
+    so the call is safe to repeat. Pipelines only queue their commands, so they are left alone.
+    """
+
+    @wraps(func)
+    def wrapper(conn: Redis, *args: Any, **kwargs: Any) -> Any:
+        try:
+            return func(conn, *args, **kwargs)
+        except ResponseError as e:
+            if isinstance(conn, Pipeline) or "Function not found" not in str(e):
+                raise
+        reload_library(conn)
+        return func(conn, *args, **kwargs)
+
+    return cast(_F, wrapper)
+
+
+@_reload_library_if_missing
 def create_queue(conn: Redis, name: str, vt: int = 60, delay: int = 0, max_size: int = 65565) -> bool:
     """
     Create a queue.
@@ -32,96 +74,325 @@ def create_queue(conn: Redis, name: str, vt: int = 60, delay: int = 0, max_size:
     return bool(result)
 
 
+@_reload_library_if_missing
 def delete_queue(conn: Redis, name: str) -> None:
     """Delete a queue and all its messages."""
     conn.fcall("delete_queue", 1, name)  # type: ignore[attr-defined]
 
 
-def list_queues(conn: Redis) -> set:
-    """List all queues."""
-    return {name.decode("utf8") for name in conn.smembers(QUEUE_SET_KEY)}
+def iter_queues(conn: Redis, count: int = 1000) -> Iterator[str]:
+    """
+    Iterate over the names of all queues.
+
+    The queue set is read with ``SSCAN``, ``count`` names at a time, so a large set neither
+    blocks the server nor has to be held in memory. A queue created or deleted while iterating
+    may or may not be included, and a name may be returned more than once.
+    """
+    # map decodes in C as the names are consumed, instead of in a generator's bytecode.
+    return map(bytes.decode, conn.sscan_iter(QUEUE_SET_KEY, count=count))
 
 
-def get_queue_info(conn: Redis, queue_name: str) -> dict:
-    """Get the config for a queue."""
-    from psmq.queue import QueueConfiguration, QueueMetadata
+def list_queues(conn: Redis) -> FrozenSet[str]:
+    """
+    List all queues.
 
-    results = list_to_dict(conn.fcall("get_queue_info", 1, queue_name))  # type: ignore[attr-defined]
-    results = {key: int(value) for key, value in results.items()}
-    config = QueueConfiguration(results.pop("vt"), results.pop("delay"), results.pop("maxsize"))
-    metadata = QueueMetadata(**results)
+    This collects :func:`iter_queues` into a set.
+    """
+    return frozenset(iter_queues(conn))
+
+
+def _parse_queue_info(reply: list) -> dict:
+    """Convert a queue info reply from Redis into configuration and metadata objects."""
+    vt, delay, maxsize, created, modified, totalrecv, totalsent, msgs, hiddenmsgs = reply
+    config = QueueConfiguration(vt, delay, maxsize)
+    metadata = QueueMetadata(totalrecv, totalsent, created, modified, msgs, hiddenmsgs)
     return {"config": config, "metadata": metadata}
 
 
+@_reload_library_if_missing
+def get_queue_info(conn: Redis, queue_name: str) -> dict:
+    """
+    Get the config for a queue.
+
+    An existing queue is read with ``FCALL_RO``, which doesn't go through the server's write path and
+    can be served by a replica. A queue that doesn't exist yet is created, as before.
+    """
+    reply = conn.fcall_ro("peek_queue_info", 1, queue_name)  # type: ignore[attr-defined]
+    if reply is None:
+        reply = conn.fcall("get_queue_info", 1, queue_name)  # type: ignore[attr-defined]
+    return _parse_queue_info(reply)
+
+
+@_reload_library_if_missing
+def create_or_get_queue(conn: Redis, name: str, vt: int = 60, delay: int = 0, max_size: int = 65565) -> dict:
+    """
+    Create a queue if it doesn't exist and get its info in one round trip.
+
+    The configuration values are only used if the queue is created.
+
+    Args:
+        conn: the Redis connection
+        name: the name of the queue
+        vt: the visibility timeout
+        delay: the initial delay
+        max_size: the maximum size of a message
+
+    Returns:
+        The queue info, in the same shape as :func:`get_queue_info`
+    """
+    validate_queue_name(name)
+    reply = conn.fcall("create_or_get_queue", 4, name, vt, delay, max_size)  # type: ignore[attr-defined]
+    return _parse_queue_info(reply)
+
+
+@_reload_library_if_missing
 def set_queue_visibility_timeout(conn: Redis, queue_name: str, vt: int) -> None:
     """Set the visibility timeout for a queue."""
     conn.fcall("set_queue_viz_timeout", 2, queue_name, vt)  # type: ignore[attr-defined]
 
 
+@_reload_library_if_missing
 def set_queue_initial_delay(conn: Redis, queue_name: str, delay: int) -> None:
     """Set the initial delay for a queue."""
     conn.fcall("set_queue_initial_delay", 2, queue_name, delay)  # type: ignore[attr-defined]
 
 
+@_reload_library_if_missing
 def set_queue_max_size(conn: Redis, queue_name: str, max_size: int) -> None:
     """Set the max size for a queue."""
     conn.fcall("set_queue_max_size", 2, queue_name, max_size)  # type: ignore[attr-defined]
 
 
-def push_message(
-    conn: Union[Redis, Pipeline],
+@_reload_library_if_missing
+def set_queue_attributes(
+    conn: Redis,
     queue_name: str,
-    message: bytes,
+    vt: Optional[int] = None,
     delay: Optional[int] = None,
-    ttl: Optional[int] = None,
-    metadata: Optional[dict] = None,
-) -> str:
-    """Send a message to a queue."""
+    max_size: Optional[int] = None,
+) -> None:
+    """
+    Set several attributes of a queue in one round trip.
+
+    Args:
+        conn: the Redis connection
+        queue_name: the name of the queue
+        vt: the new visibility timeout, or ``None`` to leave it unchanged
+        delay: the new initial delay, or ``None`` to leave it unchanged
+        max_size: the new max size, or ``None`` to leave it unchanged
+    """
+    args = ["" if value is None else value for value in (vt, delay, max_size)]
+    conn.fcall("set_queue_attributes", 4, queue_name, *args)  # type: ignore[attr-defined]
+
+
+def _pack_metadata(metadata: Optional[dict]) -> bytes:
+    """Serialize message metadata for the Lua library."""
     if metadata is None:
-        metadata = umsgpack.packb({})
+        return EMPTY_METADATA
     elif isinstance(metadata, dict):
-        metadata = umsgpack.packb(metadata)
+        return pack_metadata(metadata)
     else:
         raise TypeError("metadata must be a dict")
-    if delay is None:
-        delay = -1
-    ret_val = conn.fcall(  # type: ignore[attr-defined,union-attr]
-        "push_message", 4, queue_name, message, delay, metadata
-    )
-    if isinstance(ret_val, bytes):
-        return ret_val.decode("utf8")
-    else:
-        return ret_val
 
 
-def get_message(conn: Redis, queue_name: str, visibility_timeout: Optional[int] = None) -> Optional[ReceivedMessage]:
-    """Get a message from a queue."""
-    if visibility_timeout is not None:
-        msg_dict = list_to_dict(
-            conn.fcall("get_message", 2, queue_name, visibility_timeout)  # type: ignore[attr-defined]
+def _fcall_push_message(
+    conn: Union[Redis, Pipeline],
+    queue_name: str,
+    message: SerializedMessage,
+    delay: Optional[int],
+    packed_metadata: bytes,
+) -> Any:
+    """Call the ``push_message`` function with already packed metadata."""
+    return conn.execute_command(*_PUSH_MESSAGE, queue_name, message, -1 if delay is None else delay, packed_metadata)
+
+
+@_reload_library_if_missing
+def push_message(
+    conn: Union[Redis, Pipeline],
+    queue_name: str,
+    message: SerializedMessage,
+    delay: Optional[int] = None,
+    ttl: Optional[int] = None,
+    metadata: Optional[dict] = None,
+) -> bytes:
+    """
+    Send a message to a queue.
+
+    Returns:
+        The message id as ``bytes``. Ids are only used as Redis keys, so they are not decoded here.
+        Clients with ``decode_responses=True`` are not supported, see
+        :func:`~psmq.connection.setup_redis_connection`.
+    """
+    return _fcall_push_message(conn, queue_name, message, delay, _pack_metadata(metadata))
+
+
+def push_messages(
+    conn: Redis,
+    queue_name: str,
+    messages: Iterable[SerializedMessage],
+    delay: Optional[int] = None,
+    ttl: Optional[int] = None,
+    metadata: Optional[dict] = None,
+    chunk_size: Optional[int] = 1000,
+) -> List[bytes]:
+    """
+    Send several messages to a queue with one function call per chunk.
+
+    Each chunk of messages is sent as the arguments of a single ``push_messages``
+    call, so Redis runs one function for the whole chunk instead of one per message.
+    When there is more than one chunk, the calls are sent together in a pipeline.
+
+    Args:
+        conn: the Redis connection
+        queue_name: the name of the queue
+        messages: the serialized messages to send
+        delay: the initial delay for every message
+        ttl: the time to live for every message
+        metadata: the metadata to attach to every message
+        chunk_size: the most messages to send in one call, to keep each command a reasonable size.
+            ``None`` sends them all in one call.
+
+    Returns:
+        The message ids as ``bytes``, in the same order as ``messages``
+    """
+    packed_metadata = _pack_metadata(metadata)
+    delay_arg = -1 if delay is None else delay
+    messages = list(messages)
+    if not messages:
+        return []
+    return _push_message_chunks(conn, queue_name, messages, delay_arg, packed_metadata, chunk_size or len(messages))
+
+
+@_reload_library_if_missing
+def _push_message_chunks(
+    conn: Redis, queue_name: str, messages: List[SerializedMessage], delay_arg: int, packed_metadata: bytes, step: int
+) -> List[bytes]:
+    """Send the messages to ``push_messages``, ``step`` at a time, pipelining the calls if there are several."""
+    if len(messages) <= step:
+        return conn.fcall(  # type: ignore[attr-defined]
+            "push_messages", 3 + len(messages), queue_name, delay_arg, packed_metadata, *messages
         )
+    pipe = conn.pipeline(transaction=False)
+    for i in range(0, len(messages), step):
+        chunk = messages[i : i + step]
+        pipe.fcall("push_messages", 3 + len(chunk), queue_name, delay_arg, packed_metadata, *chunk)
+    msg_ids: List[bytes] = []
+    for chunk_ids in pipe.execute():
+        msg_ids.extend(chunk_ids)
+    return msg_ids
+
+
+def _parse_message(queue_name: str, reply: Sequence, decode: bool = True) -> ReceivedMessage:
+    """Convert a message reply from Redis into a received message, decoding its body if ``decode``."""
+    msg_id, msg_body, retrieval_count, first_retrieved, sent, packed_metadata = reply
+    if not msg_body:
+        data = None
     else:
-        msg_dict = list_to_dict(conn.fcall("get_message", 1, queue_name))  # type: ignore[attr-defined]
-    if msg_dict:
-        metadata = umsgpack.unpackb(msg_dict["metadata"])
-        metadata["sent"] = datetime.fromtimestamp(int(metadata["sent"]))
-        return ReceivedMessage(
-            queue_name=queue_name,
-            message_id=msg_dict["msg_id"],
-            data=msg_dict["msg_body"],
-            metadata=metadata,
-            sent=metadata["sent"],
-            first_retrieved=datetime.fromtimestamp(int(msg_dict["fr"]) / 1000),
-            retrieval_count=msg_dict["rc"],
-        )
-    return None
+        data = _decode(msg_body) if decode else msg_body
+    return ReceivedMessage(
+        queue_name, msg_id.decode("utf8"), data, sent, first_retrieved, retrieval_count, None, packed_metadata
+    )
+
+
+def request_message(conn: Union[Redis, Pipeline], queue_name: str, visibility_timeout: Optional[int] = None) -> Any:
+    """
+    Call ``get_message`` and return the raw reply.
+
+    On a pipeline the call is only queued. Pass its reply from ``execute`` to :func:`parse_message_reply`.
+    """
+    vt = "" if visibility_timeout is None else visibility_timeout
+    return conn.execute_command(*_GET_MESSAGE, queue_name, vt)
+
 
+def parse_message_reply(queue_name: str, reply: Sequence, decode: bool = True) -> Optional[ReceivedMessage]:
+    """Convert a ``get_message`` reply into a received message, or ``None`` if no message was visible."""
+    return _parse_message(queue_name, reply, decode) if reply else None
 
-def delete_message(conn: Redis, queue_name: str, msg_id: str) -> None:
+
+@_reload_library_if_missing
+def get_message(
+    conn: Redis, queue_name: str, visibility_timeout: Optional[int] = None, decode: bool = True
+) -> Optional[ReceivedMessage]:
+    """
+    Get a message from a queue.
+
+    The message body is decoded to ``str`` when it is valid UTF-8. Pass ``decode=False`` to keep
+    the raw ``bytes``, for example to hand them straight to a deserializer.
+    """
+    return parse_message_reply(queue_name, request_message(conn, queue_name, visibility_timeout), decode)
+
+
+@_reload_library_if_missing
+def get_messages(
+    conn: Redis, queue_name: str, count: int, visibility_timeout: Optional[int] = None, decode: bool = True
+) -> List[ReceivedMessage]:
+    """
+    Get up to ``count`` messages from a queue in one round trip.
+
+    Args:
+        conn: the Redis connection
+        queue_name: the name of the queue
+        count: the maximum number of messages to get
+        visibility_timeout: the visibility timeout for the messages, or ``None`` to use the queue's
+        decode: decode the message bodies to ``str`` when they are valid UTF-8. ``False`` keeps the ``bytes``.
+
+    Raises:
+        ValueTooLow: If ``count`` is less than 1
+
+    Returns:
+        The messages received, oldest first. It is empty if no messages are visible.
+    """
+    validate_int(count, min_value=1, raise_on_error=True)
+    vt = "" if visibility_timeout is None else visibility_timeout
+    reply = conn.execute_command(*_GET_MESSAGES, queue_name, count, vt)
+    return _parse_messages(queue_name, reply, decode)
+
+
+def _parse_messages(queue_name: str, reply: list, decode: bool = True) -> List[ReceivedMessage]:
+    """Convert a reply of several concatenated messages into received messages."""
+    fields = [iter(reply)] * len(MESSAGE_FIELDS)
+    return [_parse_message(queue_name, message, decode) for message in zip(*fields)]
+
+
+@_reload_library_if_missing
+def delete_message(conn: Redis, queue_name: str, msg_id: Union[bytes, str]) -> None:
     """Delete a message from a queue."""
-    conn.fcall("delete_message", 2, queue_name, msg_id)  # type: ignore[attr-defined]
+    conn.execute_command(*_DELETE_MESSAGE, queue_name, msg_id)
+
 
+@_reload_library_if_missing
+def delete_messages(conn: Redis, queue_name: str, msg_ids: Sequence[Union[bytes, str]]) -> None:
+    """Delete several messages from a queue, sending the calls together in one pipeline."""
+    pipe = conn.pipeline(transaction=False)
+    for msg_id in msg_ids:
+        pipe.execute_command(*_DELETE_MESSAGE, queue_name, msg_id)
+    pipe.execute()
 
+
+@_reload_library_if_missing
 def pop_message(conn: Redis, queue_name: str) -> dict:
     """Get and delete a message from a queue."""
-    return list_to_dict(conn.fcall("pop_message", 1, queue_name))  # type: ignore[attr-defined]
+    reply = conn.fcall("pop_message", 1, queue_name)  # type: ignore[attr-defined]
+    return dict(zip(MESSAGE_FIELDS, map(_decode, reply)))
+
+
+@_reload_library_if_missing
+def pop_messages(conn: Redis, queue_name: str, count: int, decode: bool = True) -> List[ReceivedMessage]:
+    """
+    Get and delete up to ``count`` messages from a queue in one round trip.
+
+    Args:
+        conn: the Redis connection
+        queue_name: the name of the queue
+        count: the maximum number of messages to pop
+        decode: decode the message bodies to ``str`` when they are valid UTF-8. ``False`` keeps the ``bytes``.
+
+    Raises:
+        ValueTooLow: If ``count`` is less than 1
+
+    Returns:
+        The messages popped, oldest first. It is empty if no messages are visible.
+    """
+    validate_int(count, min_value=1, raise_on_error=True)
+    reply = conn.execute_command(*_POP_MESSAGES, queue_name, count)
+    return _parse_messages(queue_name, reply, decode)
@@ -1,20 +1,104 @@
 """Serialize and deserialize messages."""
 
 import json
-from typing import Any, Callable
+import threading
+from typing import Any, Callable, Dict, Tuple, Union
+
+import msgpack
+
+try:
+    import orjson
+except ImportError:  # pragma: no-coverage
+    orjson = None
+
+_local = threading.local()
+
+
+def _msgpack_pack(obj: Any) -> bytes:
+    """
+    Pack an object with this thread's reusable msgpack packer.
+
+    ``msgpack.packb`` builds a new packer and buffer on every call. A packer isn't safe to share
+    between threads, so each thread keeps its own.
+    """
+    try:
+        packer = _local.packer
+    except AttributeError:
+        packer = _local.packer = msgpack.Packer(use_bin_type=True)
+    return packer.pack(obj)
+
+
+# Message metadata is always msgpack, because the Lua library reads it with cmsgpack.
+try:
+    from msgspec.msgpack import Decoder, Encoder
+
+    # One encoder and decoder are shared so they aren't rebuilt on every call.
+    pack_metadata: Callable[[Any], bytes] = Encoder().encode
+    unpack_metadata: Callable[[bytes], Any] = Decoder().decode
+except ImportError:  # pragma: no-coverage
+    pack_metadata = _msgpack_pack
+    unpack_metadata = msgpack.unpackb
 
 SerializerFunc = Callable[[Any], bytes]
-DeserializerFunc = Callable[[bytes], Any]
+DeserializerFunc = Callable[[Union[bytes, str]], Any]
 
+SerializedMessage = Union[bytes, bytearray, memoryview]
+"""A serialized message body. Redis accepts all these bytes-like types as they are."""
 
-def default_serializer(message: Any) -> bytes:
+
+def json_serializer(message: Any) -> bytes:
     """Serialize a message using JSON."""
     return json.dumps(message).encode()
 
 
-def default_deserializer(message: bytes) -> Any:
+def json_deserializer(message: Union[bytes, str]) -> Any:
     """Deserialize a message using JSON."""
     if isinstance(message, bytes):
         return json.loads(message.decode("utf-8"))
     else:
         return json.loads(message)
+
+
+def msgpack_serializer(message: Any) -> bytes:
+    """Serialize a message using msgpack."""
+    return _msgpack_pack(message)
+
+
+def msgpack_deserializer(message: Union[bytes, str]) -> Any:
+    """Deserialize a message using msgpack."""
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    return msgpack.unpackb(message, raw=False)
+
+
+SERIALIZERS: Dict[str, Tuple[SerializerFunc, DeserializerFunc]] = {
+    "json": (json_serializer, json_deserializer),
+    "msgpack": (msgpack_serializer, msgpack_deserializer),
+}
+"""The serializer and deserializer pairs that can be chosen by name."""
+
+if orjson is not None:
+    SERIALIZERS["orjson"] = (orjson.dumps, orjson.loads)
+
+# The default is always the standard library json, so a message is accepted or rejected the same way
+# whether or not the optional orjson is installed.
+default_serializer, default_deserializer = SERIALIZERS["json"]
+
+
+def get_serializers(name: str) -> Tuple[SerializerFunc, DeserializerFunc]:
+    """
+    Get a serializer and deserializer pair by name.
+
+    Args:
+        name: The name of the pair, one of the keys of :data:`SERIALIZERS`
+
+    Raises:
+        ValueError: If there is no pair with that name
+
+    Returns:
+        The serializer and deserializer functions
+    """
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown serializer '{name}'. Choose one of: {', '.join(SERIALIZERS)}") from None
@@ -1,22 +1,42 @@
-"""An interface for Redis Streams."""
+"""
+An interface for Redis Streams.
+
+Commands that are sent together are batched in pipelines without ``MULTI``/``EXEC``. Every command in
+a batch is independent, or safe to repeat, so they don't need to run as a transaction.
+"""
 
 import secrets
+import sys
 from dataclasses import dataclass
-from typing import Any, List, Optional, Union
+from itertools import starmap
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Type, Union
 
 from redis import ResponseError
-from redis.client import Redis
+from redis.client import Pipeline, Redis
+
+from psmq.async_producer import BatchedPublisher
+from psmq.utils import DATACLASS_SLOTS
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from types import TracebackType
 
-from psmq.utils import list_to_dict
+    from redis.typing import KeyT, StreamIdT
 
+_SHORT_ID_ALPHABET = b"23456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"  # pragma: allowlist secret
 
-def short_id() -> str:  # pragma: no-coverage
-    """Generate a short ID."""
-    alphabet = "23456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"  # pragma: allowlist secret
-    return "".join(secrets.choice(alphabet) for _ in range(8))
+# Maps every byte value onto the alphabet. 256 isn't a multiple of its 57 characters, so some
+# characters are slightly more likely than others, which doesn't matter for consumer names.
+_SHORT_ID_TABLE = bytes(_SHORT_ID_ALPHABET[i % len(_SHORT_ID_ALPHABET)] for i in range(256))
 
 
-@dataclass
+def short_id() -> str:
+    """Generate a short ID from one draw of random bytes."""
+    return secrets.token_bytes(8).translate(_SHORT_ID_TABLE).decode("ascii")
+
+
+@dataclass(**DATACLASS_SLOTS)
 class ConsumerGroupInfo:
     """Information about a consumer group."""
 
@@ -39,27 +59,93 @@ class ConsumerGroupInfo:
     """The number of entries in the stream that are still waiting to be delivered to the group's consumers"""
 
 
+_GROUP_INFO_FIELDS = itemgetter("name", "consumers", "pending", "last-delivered-id", "entries-read", "lag")
+"""Pull the ``XINFO GROUPS`` values out in the order of the :class:`ConsumerGroupInfo` fields."""
+
+
+def _decode_all(items: Iterable[Union[bytes, str]]) -> List[str]:
+    """Decode stream ids, keys and values, which Redis returns as ``bytes`` but may already be ``str``."""
+    items = list(items)
+    try:
+        # A str among the items makes bytes.decode raise TypeError, handled below.
+        return list(map(bytes.decode, items))  # type: ignore[arg-type]
+    except TypeError:
+        return [item.decode("utf8") if isinstance(item, bytes) else item for item in items]
+
+
+_FIELD_NAMES: Dict[Union[bytes, str], str] = {}
+"""Decoded field names, shared by all messages since streams tend to reuse a few names."""
+
+_FIELD_NAMES_MAX = 1024
+"""The most field names to remember, so streams with arbitrary field names can't grow the cache forever."""
+
+
+def _decode_field_names(names: Iterable[Union[bytes, str]]) -> List[str]:
+    """Decode field names, looking up the ones seen before instead of decoding them again."""
+    names = list(names)
+    try:
+        return [_FIELD_NAMES[name] for name in names]
+    except KeyError:
+        pass
+    decoded = list(map(sys.intern, _decode_all(names)))
+    if len(_FIELD_NAMES) < _FIELD_NAMES_MAX:
+        _FIELD_NAMES.update(zip(names, decoded))
+    return decoded
+
+
 class StreamMessage:
     """A Redis Stream message."""
 
-    def __init__(self, message_id: bytes, fields: Union[dict, list]):
-        self.message_id = message_id.decode("utf8")
+    __slots__ = ("message_id", "fields")
+
+    def __init__(self, message_id: Union[bytes, str], fields: Union[dict, list]):
+        self.message_id = message_id.decode("utf8") if isinstance(message_id, bytes) else message_id
         if isinstance(fields, dict):
-            self.fields = {k.decode("utf8"): v.decode("utf8") for k, v in fields.items()}
+            self.fields = dict(zip(_decode_field_names(fields.keys()), _decode_all(fields.values())))
         else:
-            self.fields = list_to_dict([x.decode("utf8") for x in fields])
+            self.fields = dict(zip(_decode_field_names(fields[0::2]), _decode_all(fields[1::2])))
 
     def __getattr__(self, attr: Any) -> Any:
         """Treat the attribute as a key in the fields dict."""
-        if attr in self.fields:
+        try:
             return self.fields[attr]
-        raise AttributeError(f"Attribute {attr} not found in message fields")
+        except KeyError:
+            raise AttributeError(f"Attribute {attr} not found in message fields") from None
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """
+        Get the value of a field, or ``default`` if the message doesn't have it.
+
+        Args:
+            field: The name of the field
+            default: The value to return if the field is missing
+
+        Returns:
+            The field value
+        """
+        return self.fields.get(field, default)
 
     def __repr__(self) -> str:
         """Return a string representation of the message."""
         return f"<StreamMessage {self.message_id} {self.fields}>"
 
 
+def _claimed_messages(autoclaimed: list) -> List[StreamMessage]:
+    """Convert an ``XAUTOCLAIM`` reply into messages."""
+    if len(autoclaimed) < 2:
+        return []
+    # starmap unpacks each (id, fields) pair in C, which is faster than a list comprehension.
+    return list(starmap(StreamMessage, autoclaimed[1]))
+
+
+def _read_messages(messages: Optional[list]) -> List[StreamMessage]:
+    """Convert an ``XREADGROUP`` reply for one stream into messages."""
+    if not messages:
+        return []
+    ((_name, stream_messages),) = messages
+    return list(starmap(StreamMessage, stream_messages))
+
+
 class Stream:
     """A Redis Stream."""
 
@@ -70,11 +156,93 @@ class Stream:
     ):
         self.conn = connection
         self.stream_name = name
+        self._publisher: Optional[BatchedPublisher] = None
+
+    def _pipeline(self) -> Pipeline:
+        """Start a pipeline that batches commands without a transaction."""
+        return self.conn.pipeline(transaction=False)
 
     def publish(self, fields: dict) -> str:
         """Publish a message to the stream."""
         return self.conn.xadd(self.stream_name, fields)
 
+    def publish_many(self, records: Iterable[dict], chunk: int = 1000) -> List[str]:
+        """
+        Publish several messages to the stream.
+
+        The ``XADD`` commands are sent in pipelines of at most ``chunk`` commands each.
+
+        Args:
+            records: The fields of each message to publish
+            chunk: The most messages to send in one pipeline
+
+        Returns:
+            The ids of the published messages as ``str``, like :meth:`publish_async`, in the order of ``records``
+        """
+        message_ids: List[str] = []
+        pipe = self._pipeline()
+        for fields in records:
+            pipe.xadd(self.stream_name, fields)
+            if len(pipe) >= chunk:
+                message_ids.extend(_decode_all(pipe.execute()))
+        if len(pipe):
+            message_ids.extend(_decode_all(pipe.execute()))
+        return message_ids
+
+    def publish_async(self, fields: dict) -> "Future[str]":
+        """
+        Publish a message without waiting for Redis.
+
+        The message is sent from a background thread, batched with other messages published around
+        the same time. Messages are sent in the order they are published. Call :meth:`flush` to wait
+        for them, or :meth:`close` to also stop the thread, before shutting down.
+
+        Args:
+            fields: The message fields
+
+        Returns:
+            A future that resolves to the message id
+        """
+        if self._publisher is None:
+            self._publisher = BatchedPublisher(self.conn, self.stream_name)
+        return self._publisher.publish(fields)
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait until all messages sent with :meth:`publish_async` are in the stream.
+
+        Args:
+            timeout: The most seconds to wait, or ``None`` to wait until they are sent
+        """
+        if self._publisher is not None:
+            self._publisher.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Send the messages waiting from :meth:`publish_async` and stop its background thread.
+
+        The stream can still be used afterwards. Another :meth:`publish_async` starts a new thread.
+
+        Args:
+            timeout: The most seconds to wait for the thread, or ``None`` to wait until it stops
+        """
+        if self._publisher is not None:
+            self._publisher.close(timeout)
+            self._publisher = None
+
+    def __enter__(self) -> "Stream":
+        """Use the stream, closing it when the block ends."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional["TracebackType"],
+    ) -> None:
+        """Close the stream."""
+        self.close()
+
     def create_consumer_group(self, group_name: str, from_start: bool = True) -> None:
         """
         Create a new consumer group in Redis.
@@ -93,17 +261,7 @@ class Stream:
     def list_consumer_groups(self) -> List[ConsumerGroupInfo]:
         """List all consumer groups for the stream."""
         consumers = self.conn.xinfo_groups(self.stream_name)
-        return [
-            ConsumerGroupInfo(
-                name=group["name"],
-                consumers=group["consumers"],
-                pending=group["pending"],
-                last_delivered_id=group["last-delivered-id"],
-                entries_read=group["entries-read"],
-                lag=group["lag"],
-            )
-            for group in consumers
-        ]
+        return [ConsumerGroupInfo(*_GROUP_INFO_FIELDS(group)) for group in consumers]
 
     def delete_consumer_group(self, group_name: str) -> None:
         """
@@ -140,26 +298,48 @@ class Stream:
         self.conn.xgroup_setid(self.stream_name, group_name, "$", num_messages)
 
     def create_consumer(self, group_name: str, consumer_name: str) -> None:
-        """Create a new consumer in a consumer group."""
-        self.create_consumer_group(group_name)
-        self.conn.xgroup_createconsumer(self.stream_name, group_name, consumer_name)
+        """
+        Create a new consumer in a consumer group.
+
+        The consumer group, and the stream, are created first if they don't exist. Both commands
+        are sent in one pipeline.
+        """
+        pipe = self._pipeline()
+        pipe.xgroup_create(name=self.stream_name, groupname=group_name, id="0-0", mkstream=True)
+        pipe.xgroup_createconsumer(self.stream_name, group_name, consumer_name)
+        _, created = pipe.execute(raise_on_error=False)
+        # An error creating the group means it already exists, as in create_consumer_group.
+        if isinstance(created, Exception):
+            raise created
 
 
 class Consumer:
     """A Redis Consumer."""
 
-    def __init__(self, connection: Redis, stream_name: str, group_name: str, consumer_name: Optional[str] = None):
+    def __init__(
+        self,
+        connection: Redis,
+        stream_name: str,
+        group_name: str,
+        consumer_name: Optional[str] = None,
+        ack_batch_size: int = 500,
+    ):
         self.conn = connection
         self.stream_name = stream_name
         self.stream = Stream(connection, stream_name)
         self.group_name = group_name
         self.consumer_name = consumer_name or short_id()
         self.max_pending_time = 3000  # 3 seconds
+        self.ack_batch_size = ack_batch_size
+        self._streams_query: Dict["KeyT", "StreamIdT"] = {stream_name: ">"}  # Read new messages from this stream
         self._setup()
 
+    def _pipeline(self) -> Pipeline:
+        """Start a pipeline that batches commands without a transaction."""
+        return self.stream._pipeline()
+
     def _setup(self) -> None:
         """Create the consumer group and consumer if they don't exist."""
-        self.stream.create_consumer_group(self.group_name)
         self.stream.create_consumer(self.group_name, self.consumer_name)
 
     def get(self, count: int = 1, timeout: Optional[int] = None) -> list:
@@ -168,6 +348,10 @@ class Consumer:
 
         Messages are not acknowledged and require an explicit call to `ack` for each message id.
 
+        Idle messages claimed from other consumers come first, then new messages. New messages are
+        only read for what the claim left, so this consumer never holds more unacknowledged messages
+        than it returned.
+
         Args:
             count: The number of messages to consume
             timeout: The number of milliseconds to wait for messages. None means do not wait.
@@ -175,18 +359,17 @@ class Consumer:
         Returns:
             A list of messages received within the timeout
         """
-        claimed_msgs = self.autoclaim(count)
-        if len(claimed_msgs) == count:
-            return claimed_msgs
-        else:
-            remaining = count - len(claimed_msgs)
-            messages = self.conn.xreadgroup(
-                self.group_name, self.consumer_name, {self.stream_name: ">"}, count=remaining, block=timeout
-            )
-            messages = messages or [("", [])]
-            stream_msgs = messages[0][1]
-            msgs = [StreamMessage(message_id, fields) for message_id, fields in stream_msgs]
-            return claimed_msgs + msgs
+        msgs = self.autoclaim(count)
+        if len(msgs) == count:
+            return msgs
+
+        # Reading after the claim, instead of pipelining both for `count`, means no extra messages are
+        # delivered to this consumer and left pending, where a later claim could hand them out again.
+        read = self.conn.xreadgroup(
+            self.group_name, self.consumer_name, self._streams_query, count=count - len(msgs), block=timeout
+        )
+        msgs.extend(_read_messages(read))
+        return msgs
 
     def autoclaim(self, count: int = 1, pending_ms: Optional[int] = None) -> list:
         """
@@ -208,16 +391,31 @@ class Consumer:
             start_id="0-0",
             count=count,
         )
-        if len(autoclaimed) < 2:
-            return []
-        claimed_msgs = autoclaimed[1]
-        return [StreamMessage(message_id, fields) for message_id, fields in claimed_msgs]
+        return _claimed_messages(autoclaimed)
+
+    def ack(self, message_ids: Union[str, Iterable[str]]) -> None:
+        """
+        Acknowledge one or more messages.
 
-    def ack(self, message_ids: Union[str, List[str]]) -> None:
-        """Acknowledge a message."""
+        The ids are sent in ``XACK`` commands of at most ``ack_batch_size`` ids each. When there is
+        more than one command, they are sent together in a pipeline.
+
+        Args:
+            message_ids: The id, or ids, of the messages to acknowledge
+        """
         if isinstance(message_ids, str):
             message_ids = [message_ids]
-        self.conn.xack(self.stream_name, self.group_name, *message_ids)
+        else:
+            message_ids = list(message_ids)
+        if not message_ids:
+            return
+        if len(message_ids) <= self.ack_batch_size:
+            self.conn.xack(self.stream_name, self.group_name, *message_ids)
+            return
+        pipe = self._pipeline()
+        for i in range(0, len(message_ids), self.ack_batch_size):
+            pipe.xack(self.stream_name, self.group_name, *message_ids[i : i + self.ack_batch_size])
+        pipe.execute()
 
     def pop(self, count: int = 1, timeout: Optional[int] = None) -> list:
         """
@@ -235,12 +433,70 @@ class Consumer:
         messages = self.conn.xreadgroup(
             self.group_name,
             self.consumer_name,
-            streams={self.stream_name: ">"},
+            streams=self._streams_query,
             count=count,
             block=timeout,
             noack=True,
         )
 
-        messages = messages or [("", [])]
-        stream_msgs = messages[0][1]
-        return [StreamMessage(message_id, fields) for message_id, fields in stream_msgs]
+        return _read_messages(messages)
+
+    def pop_reliable(self, count: int = 1, timeout: Optional[int] = None) -> list:
+        """
+        Pop messages from the stream, acknowledging them only once they were received.
+
+        Unlike :meth:`pop`, the messages are read into the consumer's pending list and then
+        acknowledged. If the reply is lost on the way, say because the connection drops, the
+        messages stay pending and another consumer can claim them. The cost is a second round trip
+        for the ``XACK`` whenever messages are read.
+
+        Args:
+            count: The number of messages to pop
+            timeout: The number of milliseconds to wait for messages. None means do not wait.
+
+        Returns:
+            A list of messages received within the timeout
+        """
+        messages = _read_messages(
+            self.conn.xreadgroup(
+                self.group_name,
+                self.consumer_name,
+                streams=self._streams_query,
+                count=count,
+                block=timeout,
+            )
+        )
+        if messages:
+            self.ack([message.message_id for message in messages])
+        return messages
+
+
+def pop_many(conn: Redis, consumers: Iterable[Consumer], count: int = 1) -> Dict[str, List[StreamMessage]]:
+    """
+    Pop messages for several consumers in one round trip.
+
+    Each consumer's ``XREADGROUP`` is sent in one pipeline. Like :meth:`Consumer.pop`, the messages
+    are acknowledged automatically when read, and nothing waits for new messages.
+
+    Args:
+        conn: The Redis connection
+        consumers: The consumers to pop messages for
+        count: The most messages to pop for each consumer
+
+    Returns:
+        The messages popped, by stream name. Consumers reading the same stream share one list.
+    """
+    consumers = list(consumers)
+    pipe = conn.pipeline(transaction=False)
+    for consumer in consumers:
+        pipe.xreadgroup(
+            consumer.group_name,
+            consumer.consumer_name,
+            streams=consumer._streams_query,
+            count=count,
+            noack=True,
+        )
+    results: Dict[str, List[StreamMessage]] = {}
+    for consumer, messages in zip(consumers, pipe.execute()):
+        results.setdefault(consumer.stream_name, []).extend(_read_messages(messages))
+    return results
@@ -0,0 +1,55 @@
+"""Data types shared by the queue modules."""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from psmq.utils import DATACLASS_SLOTS
+
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
+class QueueConfiguration:
+    """Configuration for a queue."""
+
+    visibility_timeout: int = 60
+    """The length of time, in seconds, that a message received from a queue will
+    be invisible to other receiving components when they ask to receive messages."""
+
+    initial_delay: int = 0
+    "The time in seconds that the delivery of all new messages in the queue will be delayed"
+
+    max_size: int = 65565
+    "The maximum size of a message in bytes"
+
+    retries: int = 5
+    "The number of times to retry a message before giving up."
+
+    ttl: Optional[int] = None
+    "The optional time to live for a message in milliseconds."
+
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
+class QueueMetadata:
+    """Metadata for a queue."""
+
+    totalrecv: int
+    "Total number of messages received from (taken off of) the queue"
+
+    totalsent: int
+    "Total number of messages sent to this queue"
+
+    created: int
+    "Timestamp (epoch in seconds) when the queue was created"
+
+    modified: int
+    "Timestamp (epoch in seconds) when the queue was last modified"
+
+    msgs: int
+    "Current number of messages in the queue"
+
+    hiddenmsgs: int
+    """
+    Current number of hidden / not visible messages.
+
+    A message typically is hidden while "in flight". This number can be a good measurement for
+    how many messages are currently being processed.
+    """
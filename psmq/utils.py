@@ -1,20 +1,17 @@
 """Utility functions for the psmq package."""
-from itertools import islice
-from typing import Any, Iterable, Tuple
+import sys
+from typing import Any
 
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+"""Keyword arguments that give a dataclass ``__slots__`` on Python versions that support it."""
 
-def list_to_dict(kv_list: list) -> dict:
-    """Convert a list of alternating key-value pairs into a dict."""
 
-    def batched(iterable: Iterable) -> Iterable[Tuple[Any, Any]]:
-        it = iter(iterable)
-        while batch := tuple(islice(it, 2)):
-            yield batch  # type: ignore[misc]
-
-    r_str = []
-    for item in kv_list:
+def _decode(item: Any) -> Any:
+    """Decode ``bytes`` to ``str`` when possible, leaving everything else untouched."""
+    # An exact type check is cheaper than isinstance, and replies are plain bytes.
+    if type(item) is bytes:  # noqa: E721
         try:
-            r_str.append(item.decode("utf8") if isinstance(item, bytes) else item)
+            return item.decode("utf8")
         except UnicodeDecodeError:
-            r_str.append(item)
-    return dict(batched(r_str))
+            return item
+    return item
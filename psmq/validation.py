@@ -1,6 +1,7 @@
 """Validation functions."""
 
 import re
+import string
 from typing import Any, Optional
 
 from .exceptions import (
@@ -14,6 +15,9 @@ from .exceptions import (
 #: :obj:`re.Pattern`: A compiled regular expression that detects all invalid characters
 QNAME_INVALID_CHARS_RE = re.compile(r"[^A-Za-z0-9._-]")
 
+#: dict: A :meth:`str.translate` table that deletes every valid queue name character, leaving the invalid ones
+QNAME_DELETE_VALID_CHARS = str.maketrans("", "", string.ascii_letters + string.digits + "._-")
+
 #: int: The maximum number of characters allowed in a :class:`~rsmq.queue.Queue` name
 QNAME_MAX_LENGTH = 160
 
@@ -47,10 +51,10 @@ def validate_queue_name(qname: str, raise_on_error: bool = False) -> bool:
         else:
             return False
 
-    invalid_chars = QNAME_INVALID_CHARS_RE.search(qname)
+    invalid_chars = qname.translate(QNAME_DELETE_VALID_CHARS)
     if invalid_chars:
         if raise_on_error:
-            raise InvalidCharacter(qname[invalid_chars.span()[0]])
+            raise InvalidCharacter(invalid_chars[0])
         else:
             return False
     return True
@@ -65,6 +69,8 @@ def validate_int(
     """
     Validate value is integer and between min and max values (if specified).
 
+    A ``bool`` is not accepted as an integer.
+
     Raises:
         TypeError: If ``value`` is not an ``int``
         ValueTooLow: If ``value`` is lower than a specified ``min_value``
@@ -79,7 +85,13 @@ def validate_int(
     Returns:
         ``True`` if valid, ``False`` otherwise if ``raise_on_error`` is ``False``
     """
-    if value is None or not isinstance(value, int):
+    # An exact type check, so a bool doesn't pass as an int.
+    is_int = type(value) is int  # noqa: E721
+    if is_int and (min_value is None or value >= min_value) and (max_value is None or value <= max_value):
+        return True
+
+    # Only an invalid value gets here, to work out which error to report.
+    if not is_int:
         if raise_on_error:
             raise TypeError("An integer value is required.")
         else:
@@ -109,6 +121,8 @@ def validate_float(
     """
     Validate value is integer and between min and max values (if specified).
 
+    A ``bool`` is not accepted as a number.
+
     Raises:
         TypeError: If ``value`` is not an ``int``
         ValueTooLow: If ``value`` is lower than a specified ``min_value``
@@ -123,7 +137,15 @@ def validate_float(
     Returns:
         ``True`` if valid, ``False`` otherwise if ``quiet`` is ``True``
     """
-    if value is None or not isinstance(value, (int, float)):
+    if (
+        type(value) in (int, float)
+        and (min_value is None or value >= min_value)
+        and (max_value is None or value <= max_value)
+    ):
+        return True
+
+    # Only an invalid value gets here, to work out which error to report.
+    if type(value) not in (int, float):
         if quiet:
             return False
         raise TypeError("An integer or float value is required.")
@@ -1,12 +1,48 @@
-from pathlib import Path
+import os
+from typing import Callable, Tuple
 
 import pytest
 from redis.client import Redis
+from redis.exceptions import ResponseError
 
-from psmq.connection import get_redis_from_path
+from psmq.connection import get_redis_from_path, get_redis_from_url
+
+
+@pytest.fixture(scope="session")
+def _redis_server(tmp_path_factory: pytest.TempPathFactory) -> Redis:
+    """
+    Start one RedisLite server, with the PSMQ library loaded, for the whole test session.
+
+    Set ``PSMQ_TEST_REDIS_URL`` to use a running server instead. Its database is flushed before every
+    test. The library is made of Redis Functions, so the server must be Redis 7 or later.
+    """
+    url = os.environ.get("PSMQ_TEST_REDIS_URL")
+    try:
+        if url:
+            return get_redis_from_url(url)
+        return get_redis_from_path(tmp_path_factory.mktemp("redis"))
+    except ResponseError as e:
+        pytest.exit(f"Could not load the PSMQ library, which needs Redis 7 or later: {e}", returncode=1)
+
+
+@pytest.fixture
+def conn(_redis_server: Redis) -> Redis:
+    """Get a RedisLite connection to an empty database."""
+    # FLUSHDB leaves the loaded functions alone, so the library doesn't need loading again.
+    # ASYNC empties the keyspace at once and frees the old keys in the background, like UNLINK.
+    _redis_server.flushdb(asynchronous=True)
+    return _redis_server
 
 
 @pytest.fixture
-def conn(tmp_path: Path) -> Redis:
-    """Get a RedisLite connection."""
-    return get_redis_from_path(tmp_path)
+def snapshot(conn: Redis) -> Callable[[str], Tuple[list, dict]]:
+    """Get a function that reads a queue's scored messages and its info hash in one round trip."""
+
+    def take(queue_name: str) -> Tuple[list, dict]:
+        pipe = conn.pipeline(transaction=False)
+        pipe.zrange(queue_name, 0, -1, withscores=True)
+        pipe.hgetall(f"{queue_name}:Q")
+        messages, queue_stats = pipe.execute()
+        return messages, queue_stats
+
+    return take
@@ -0,0 +1,134 @@
+"""Tests of the batched background producer."""
+
+import threading
+from typing import List
+
+import pytest
+from redis.client import Redis
+from redis.exceptions import DataError
+
+from psmq import queue_ops
+from psmq.async_producer import BatchedProducer, BatchedPublisher, _BackgroundBatcher
+from psmq.queue import Queue
+from psmq.stream import Stream
+
+
+class TestBatchedProducer:
+    """Tests of pushing messages from a background thread."""
+
+    def test_push_resolves_future_with_message_id(self, conn: Redis):
+        """The future for a pushed message resolves to its id."""
+        with BatchedProducer(conn, "test_queue", linger_ms=1) as producer:
+            future = producer.push(b"foo", delay=0)
+            msg_id = future.result(timeout=5)
+        assert conn.hget("test_queue:Q", msg_id) == b"foo"
+
+    def test_flush_sends_messages_in_order(self, conn: Redis):
+        """Flushing sends every waiting message, in the order they were pushed."""
+        producer = BatchedProducer(conn, "test_queue", batch_size=2, linger_ms=1000)
+        futures = [producer.push(str(i).encode("utf8"), delay=0) for i in range(5)]
+        producer.flush(timeout=5)
+        msg_ids = [future.result(timeout=0) for future in futures]
+        assert msg_ids == sorted(msg_ids)
+        assert [conn.hget("test_queue:Q", msg_id) for msg_id in msg_ids] == [b"0", b"1", b"2", b"3", b"4"]
+        producer.close()
+
+    def test_close_sends_waiting_messages(self, conn: Redis):
+        """Closing the producer sends the messages still waiting."""
+        producer = BatchedProducer(conn, "test_queue", linger_ms=1000)
+        future = producer.push(b"foo")
+        producer.close(timeout=5)
+        assert future.done()
+        assert queue_ops.get_queue_info(conn, "test_queue")["metadata"].totalsent == 1
+
+
+class TestBackgroundBatcher:
+    """Tests of the shared background sending."""
+
+    def test_a_batch_that_cannot_be_built_fails_its_futures(self, conn: Redis):
+        """An error adding a batch's commands is set on its futures, and later batches are still sent."""
+        with BatchedPublisher(conn, "test", linger_ms=1) as publisher:
+            bad = publisher.publish({})
+            with pytest.raises(DataError):
+                bad.result(timeout=5)
+            good = publisher.publish({"key": "value"})
+            assert good.result(timeout=5)
+        assert conn.xlen("test") == 1
+
+    def test_flush_waits_for_a_batch_being_sent(self, conn: Redis):
+        """Flushing waits for a batch the background thread has already taken off the queue."""
+        sending = threading.Event()
+        release = threading.Event()
+
+        class SlowPublisher(BatchedPublisher):
+            def _send(self, batch: list) -> None:
+                sending.set()
+                release.wait(5)
+                super()._send(batch)
+
+        publisher = SlowPublisher(conn, "test", linger_ms=1)
+        future = publisher.publish({"key": "value"})
+        assert sending.wait(5)
+        flusher = threading.Thread(target=publisher.flush, kwargs={"timeout": 5})
+        flusher.start()
+        flusher.join(0.1)
+        assert flusher.is_alive()
+        release.set()
+        flusher.join(5)
+        assert not flusher.is_alive()
+        assert future.done()
+        publisher.close()
+
+    def test_subclasses_must_add_commands(self, conn: Redis):
+        """A batcher that doesn't say how to add its commands can't be created."""
+
+        class Incomplete(_BackgroundBatcher):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete(conn, "incomplete")
+
+        class Complete(_BackgroundBatcher):
+            def _add_commands(self, pipeline: object, items: List[bytes]) -> None:
+                pass
+
+        Complete(conn, "complete").close()
+
+
+def test_queue_push_async(conn: Redis):
+    """Queue.push_async serializes the message and sends it in the background."""
+    q = Queue(conn, "test_queue")
+    future = q.push_async({"a": 1}, delay=0)
+    q.flush(timeout=5)
+    msg = q.get()
+    assert msg.message_id == future.result(timeout=0)
+    assert msg.data == {"a": 1}
+
+
+def test_queue_close_stops_the_producer_thread(conn: Redis):
+    """Closing a queue sends its waiting messages and ends the producer thread."""
+    with Queue(conn, "test_queue") as q:
+        future = q.push_async("test", delay=0)
+        thread = q._producer._thread
+    assert not thread.is_alive()
+    assert q.get().message_id == future.result(timeout=0)
+    q.close()
+
+
+def test_stream_close_stops_the_publisher_thread(conn: Redis):
+    """Closing a stream sends its waiting messages and ends the publisher thread."""
+    with Stream(conn, "test") as stream:
+        future = stream.publish_async({"key": "value"})
+        thread = stream._publisher._thread
+    assert not thread.is_alive()
+    assert conn.xrange("test")[0][0].decode("utf8") == future.result(timeout=0)
+
+
+def test_stream_publish_async(conn: Redis):
+    """Stream.publish_async sends the messages in the background, in order."""
+    stream = Stream(conn, "test")
+    futures = [stream.publish_async({"key": str(i)}) for i in range(3)]
+    stream.flush(timeout=5)
+    assert [message_id.decode("utf8") for message_id, _ in conn.xrange("test")] == [
+        future.result(timeout=0) for future in futures
+    ]
@@ -0,0 +1,45 @@
+"""Tests of batching queue operations."""
+
+import pytest
+from redis.client import Redis
+from redis.exceptions import ResponseError
+
+from psmq import queue_ops
+from psmq.batch import QueueBatch
+
+
+class TestQueueBatch:
+    """Tests of running several operations in one pipeline."""
+
+    def test_operations_run_on_exit(self, conn: Redis):
+        """Operations are only sent when the block exits, then their futures resolve."""
+        queue_ops.create_queue(conn, "test_queue", delay=0)
+        with QueueBatch(conn) as batch:
+            pushed = batch.push("test_queue", b"foo", delay=0)
+            received = batch.get("test_queue2")
+            assert not pushed.done()
+        msg_id = pushed.result(timeout=0)
+        assert conn.hget("test_queue:Q", msg_id) == b"foo"
+        assert received.result(timeout=0) is None
+
+    def test_get_and_delete(self, conn: Redis):
+        """Gets and deletes in one batch see the pushes made before it."""
+        msg_id = queue_ops.push_message(conn, "test_queue", b"foo", 0).decode("utf8")
+        with QueueBatch(conn) as batch:
+            received = batch.get("test_queue")
+            deleted = batch.delete("test_queue", msg_id)
+        msg = received.result(timeout=0)
+        assert msg.message_id == msg_id
+        assert msg.data == "foo"
+        assert deleted.result(timeout=0) is None
+        assert queue_ops.get_queue_info(conn, "test_queue")["metadata"].msgs == 0
+
+    def test_errors_are_set_on_the_failing_future(self, conn: Redis):
+        """An error from Redis is set on the future of the operation that caused it."""
+        conn.set("not_a_queue", "foo")
+        with QueueBatch(conn) as batch:
+            pushed = batch.push("test_queue", b"foo", delay=0)
+            failed = batch.get("not_a_queue")
+        assert pushed.result(timeout=0)
+        with pytest.raises(ResponseError):
+            failed.result(timeout=0)
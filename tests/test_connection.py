@@ -0,0 +1,45 @@
+"""Tests of the connection helpers."""
+
+from pathlib import Path
+
+import pytest
+from redis import ConnectionPool
+from redis.client import Redis
+
+from psmq.connection import get_redis_from_path, get_redis_from_pool, get_redis_from_url, setup_redis_connection
+
+
+def test_setup_only_loads_library_once_per_pool(conn: Redis, mocker):
+    """The library is not re-uploaded for a connection pool that already has it."""
+    function_load = mocker.spy(conn, "function_load")
+    setup_redis_connection(conn)
+    setup_redis_connection(conn)
+    assert function_load.call_count == 0
+    assert conn.fcall("b36encode", 1, "35") == b"Z"
+
+
+def test_clients_from_same_pool_share_the_library(conn: Redis, mocker):
+    """A client built from an already set up pool can call the library without reloading it."""
+    function_load = mocker.spy(Redis, "function_load")
+    client = get_redis_from_pool(conn.connection_pool)
+    assert client.connection_pool is conn.connection_pool
+    assert function_load.call_count == 0
+    assert client.fcall("b36encode", 1, "35") == b"Z"
+
+
+def test_decoding_clients_are_rejected():
+    """A client that decodes its replies can't be used, because messages and metadata are binary."""
+    with pytest.raises(ValueError):
+        get_redis_from_pool(ConnectionPool(decode_responses=True))
+
+
+def test_unhashable_options_skip_the_client_cache(conn: Redis, mocker):
+    """Options that can't be cache keys, like a list, still create a client."""
+    from_url = mocker.patch.object(Redis, "from_url", return_value=conn)
+    assert get_redis_from_url("redis://localhost", retry_on_error=[TimeoutError]) is conn
+    from_url.assert_called_once_with("redis://localhost", max_connections=None, retry_on_error=[TimeoutError])
+
+
+def test_clients_are_cached_by_path(tmp_path: Path):
+    """Asking for a client for the same path returns the same client."""
+    assert get_redis_from_path(tmp_path) is get_redis_from_path(tmp_path)
@@ -0,0 +1,79 @@
+"""Tests of the QueueManager class."""
+
+from redis.client import Redis
+
+from psmq.manager import QueueManager
+from psmq.queue import QueueConfiguration
+from psmq.serialize import msgpack_serializer
+
+
+class TestGetQueue:
+    """Tests of getting queues from the manager."""
+
+    def test_creates_queue(self, conn: Redis):
+        """Getting a queue creates it with the default configuration."""
+        qm = QueueManager(conn)
+        q = qm.get_queue("test_queue", default_config=QueueConfiguration(visibility_timeout=10))
+        assert q.name == "test_queue"
+        assert q._configuration.visibility_timeout == 10
+        assert "test_queue" in qm.queues()
+
+    def test_returns_same_queue(self, conn: Redis, mocker):
+        """Getting the same queue twice returns the cached queue."""
+        qm = QueueManager(conn)
+        q = qm.get_queue("test_queue")
+        fcall = mocker.spy(conn, "fcall")
+        assert qm.get_queue("test_queue") is q
+        assert fcall.call_count == 0
+
+    def test_builds_a_new_queue_for_other_serializers(self, conn: Redis):
+        """Asking for a queue with serializers doesn't return the cached queue without them."""
+        qm = QueueManager(conn)
+        q = qm.get_queue("test_queue")
+        msgpack_queue = qm.get_queue("test_queue", serializer="msgpack", deserializer="msgpack")
+        assert msgpack_queue is not q
+        assert msgpack_queue.serializer is msgpack_serializer
+        assert qm.get_queue("test_queue") is msgpack_queue
+
+    def test_closes_the_replaced_queue(self, conn: Redis):
+        """A queue replaced in the cache has its producer thread stopped."""
+        qm = QueueManager(conn)
+        q = qm.get_queue("test_queue")
+        q.push_async("test", delay=0)
+        thread = q._producer._thread
+        qm.get_queue("test_queue", serializer="msgpack")
+        assert not thread.is_alive()
+        assert q._producer is None
+
+    def test_deletes_queue(self, conn: Redis):
+        """Deleting a queue removes it from Redis and the cache."""
+        qm = QueueManager(conn)
+        q = qm.get_queue("test_queue")
+        qm.delete_queue("test_queue")
+        assert "test_queue" not in qm.queues()
+        assert qm.get_queue("test_queue") is not q
+
+
+class TestListQueues:
+    """Tests of listing queues."""
+
+    def test_returns_a_set_of_queue_names(self, conn: Redis):
+        """The manager lists all queue names."""
+        qm = QueueManager(conn)
+        assert qm.queues() == set()
+        qm.get_queue("test_queue")
+        assert qm.queues() == {"test_queue"}
+        qm.get_queue("test_queue2")
+        assert qm.queues() == {"test_queue", "test_queue2"}
+        qm.delete_queue("test_queue")
+        assert qm.queues() == {"test_queue2"}
+
+    def test_caches_the_names_until_refreshed(self, conn: Redis, mocker):
+        """Queues created elsewhere are listed after a refresh."""
+        qm = QueueManager(conn)
+        assert qm.queues() == set()
+        QueueManager(conn).get_queue("test_queue")
+        sscan = mocker.spy(conn, "sscan_iter")
+        assert qm.queues() == set()
+        assert sscan.call_count == 0
+        assert qm.queues(refresh=True) == {"test_queue"}
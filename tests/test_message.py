@@ -0,0 +1,27 @@
+"""Tests of the message classes."""
+
+from datetime import datetime
+
+from psmq.message import ReceivedMessage
+
+
+class TestReceivedMessage:
+    """Tests of the received message timestamps."""
+
+    def test_timestamps_are_epoch_milliseconds(self):
+        """The datetime properties are built from the epoch millisecond fields."""
+        msg = ReceivedMessage("test_queue", "id", None, 1_700_000_000_123, 1_700_000_000_456, 1)
+        assert msg.sent_dt == datetime.fromtimestamp(1_700_000_000.123)
+        assert msg.first_retrieved_dt == datetime.fromtimestamp(1_700_000_000.456)
+
+    def test_expires_is_sent_plus_ttl(self):
+        """A message with a ttl expires ttl seconds after it was sent."""
+        msg = ReceivedMessage("test_queue", "id", None, 1_700_000_000_123, 1_700_000_000_456, 1, ttl=5)
+        assert msg.expires_ms == 1_700_000_005_123
+        assert msg.expires == datetime.fromtimestamp(1_700_000_005.123)
+
+    def test_no_ttl_never_expires(self):
+        """A message without a ttl has no expiry."""
+        msg = ReceivedMessage("test_queue", "id", None, 1_700_000_000_123, 1_700_000_000_456, 1)
+        assert msg.expires_ms is None
+        assert msg.expires is None
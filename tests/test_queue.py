@@ -1,12 +1,16 @@
 """Tests of the Queue class."""
 
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
 import pytest
 from redis.client import Redis
 
 from psmq import queue_ops
 from psmq.exceptions import NoMessageInQueue, UndeserializableMessage, UnserializableMessage
+from psmq.message import CachedMessage, RawMessage
 from psmq.queue import Queue, QueueConfiguration, QueueMetadata
-from psmq.serialize import default_deserializer, default_serializer
+from psmq.serialize import default_deserializer, default_serializer, msgpack_deserializer, msgpack_serializer
 
 
 class TestCreation:
@@ -22,6 +26,41 @@ class TestCreation:
         assert q.deserializer is default_deserializer
         assert "test_queue" in queue_ops.list_queues(conn)
 
+    def test_instantiation_makes_one_round_trip(self, conn: Redis, mocker):
+        """Creating a Queue object creates and reads the queue in one call."""
+        fcall = mocker.spy(conn, "fcall")
+        Queue(conn, "test_queue", default_config=QueueConfiguration(visibility_timeout=10))
+        assert fcall.call_count == 1
+
+    def test_lazy_instantiation_defers_round_trip(self, conn: Redis, mocker):
+        """A lazy Queue only contacts Redis when its configuration is needed."""
+        fcall = mocker.spy(conn, "fcall")
+        q = Queue(conn, "test_queue", default_config=QueueConfiguration(visibility_timeout=10), lazy=True)
+        assert fcall.call_count == 0
+        assert q._configuration.visibility_timeout == 10
+        assert q._configuration.visibility_timeout == 10
+        assert fcall.call_count == 1
+
+    def test_invalidate_refetches_configuration(self, conn: Redis):
+        """After invalidating, the configuration is read from Redis again."""
+        q = Queue(conn, "test_queue")
+        queue_ops.set_queue_visibility_timeout(conn, "test_queue", 20)
+        assert q._configuration.visibility_timeout == 60
+        q.invalidate()
+        assert q._configuration.visibility_timeout == 20
+
+    def test_metadata_is_only_cached_on_request(self, conn: Redis, mocker):
+        """Metadata is fetched on every call, unless the copy cached since this queue's last operation is asked for."""
+        q = Queue(conn, "test_queue")
+        queue_ops.push_message(conn, "test_queue", b"test", 0)
+        fcall_ro = mocker.spy(conn, "fcall_ro")
+        assert q.metadata(cached=True).msgs == 0
+        assert fcall_ro.call_count == 0
+        assert q.metadata().msgs == 1
+        assert fcall_ro.call_count == 1
+        q.push("test2")
+        assert q.metadata(cached=True).msgs == 2
+
     def test_instantiation_is_idempotent(self, conn: Redis):
         """Creating a Queue object is idempotent."""
         q1 = Queue(conn, "test_queue")
@@ -34,20 +73,39 @@ class TestCreation:
 class TestSerialization:
     """Tests the serialization of messages."""
 
-    def test_calls_serializer_function(self, conn: Redis, mocker):
+    def test_calls_serializer_function(self, conn: Redis):
         """You can serialize a message."""
-        mocked_serializer = mocker.Mock()
-        mocked_serializer.return_value = b"test"
-        q = Queue(conn, "test_queue", serializer=mocked_serializer)
+        calls = []
+
+        def serializer(message):
+            calls.append(message)
+            return b"test"
+
+        q = Queue(conn, "test_queue", serializer=serializer)
         assert q.serialize("test") == b"test"
-        assert mocked_serializer.call_count == 1
-        mocked_serializer.assert_called_with("test")
+        assert calls == ["test"]
+
+    def test_cached_message_is_serialized_once(self, conn: Redis):
+        """A CachedMessage reuses its serialized bytes with the same serializer."""
+        calls = []
+
+        def serializer(message):
+            calls.append(message)
+            return b"test"
 
-    def test_wraps_errors(self, conn: Redis, mocker):
+        q = Queue(conn, "test_queue", serializer=serializer)
+        message = CachedMessage("test")
+        assert q.serialize(message) == b"test"
+        assert q.serialize(message) == b"test"
+        assert calls == ["test"]
+
+    def test_wraps_errors(self, conn: Redis):
         """Attempting to serialize a message with a serializer that raises an exception raises an exception."""
-        mocked_serializer = mocker.Mock(__name__="test_serializer")
-        mocked_serializer.side_effect = Exception("test")
-        q = Queue(conn, "test_queue", serializer=mocked_serializer)
+
+        def test_serializer(message):
+            raise Exception("test")
+
+        q = Queue(conn, "test_queue", serializer=test_serializer)
         with pytest.raises(UnserializableMessage):
             q.serialize("test")
 
@@ -55,23 +113,77 @@ class TestSerialization:
 class TestDeserialization:
     """Tests the deserialization of messages."""
 
-    def test_calls_deserializer(self, conn: Redis, mocker):
+    def test_calls_deserializer(self, conn: Redis):
         """You can deserialize a message."""
-        mocked_deserializer = mocker.Mock()
-        mocked_deserializer.return_value = "test"
-        q = Queue(conn, "test_queue", deserializer=mocked_deserializer)
+        calls = []
+
+        def deserializer(message):
+            calls.append(message)
+            return "test"
+
+        q = Queue(conn, "test_queue", deserializer=deserializer)
         assert q.deserialize(b"test") == "test"
-        assert mocked_deserializer.call_count == 1
-        mocked_deserializer.assert_called_with(b"test")
+        assert calls == [b"test"]
 
-    def test_deserialize_wraps_errors(self, conn: Redis, mocker):
+    def test_deserialize_wraps_errors(self, conn: Redis):
         """Attempting to deserialize a message with a deserializer that raises an exception raises an exception."""
-        mocked_deserializer = mocker.Mock(__name__="test_deserializer")
-        mocked_deserializer.side_effect = Exception("test")
-        q = Queue(conn, "test_queue", deserializer=mocked_deserializer)
+
+        def test_deserializer(message):
+            raise Exception("test")
+
+        q = Queue(conn, "test_queue", deserializer=test_deserializer)
         with pytest.raises(UndeserializableMessage):
             q.deserialize(b"test")
 
+    @pytest.mark.parametrize("data", [b'"test"', bytearray(b'"test"'), memoryview(b'"test"')])
+    def test_raw_messages_are_sent_as_is(self, conn: Redis, data):
+        """A RawMessage skips the serializer."""
+        calls = []
+
+        def test_serializer(message):
+            calls.append(message)
+            return b""
+
+        q = Queue(conn, "test_queue", serializer=test_serializer)
+        message = RawMessage(data)
+        assert q.serialize(message) is data
+        q.push(message)
+        q.push_many([message])
+        assert calls == []
+        assert [msg.data for msg in q.get_many(2)] == ["test", "test"]
+
+    @pytest.mark.parametrize("data", [b"\x01\x02payload", b"\x93\x01\x02\x03"])
+    def test_bytes_are_serialized(self, conn: Redis, data):
+        """Plain bytes go through the serializer, so msgpack sends them back as bytes."""
+        q = Queue(conn, "test_queue", serializer="msgpack")
+        q.push(data)
+        q.push_many([data])
+        assert [msg.data for msg in q.get_many(2)] == [data, data]
+
+
+class TestNamedSerializers:
+    """Tests choosing a serializer by name."""
+
+    def test_name_sets_serializer_and_deserializer(self, conn: Redis):
+        """A serializer name sets both halves of the pair and round-trips messages."""
+        q = Queue(conn, "test_queue", serializer="msgpack")
+        assert q.serializer is msgpack_serializer
+        assert q.deserializer is msgpack_deserializer
+        q.push({"a": 1})
+        assert q.get().data == {"a": 1}
+
+    def test_msgpack_serializer_matches_packb_in_every_thread(self):
+        """The reused packer writes the same bytes as msgpack.packb, in any thread."""
+        messages = [{"a": i, "b": b"bytes"} for i in range(10)]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(msgpack_serializer, messages))
+        assert results == [msgpack.packb(message, use_bin_type=True) for message in messages]
+
+    def test_unknown_name_raises_error(self, conn: Redis):
+        """An unknown serializer name raises a ValueError."""
+        with pytest.raises(ValueError):
+            Queue(conn, "test_queue", serializer="pickle")
+
 
 class TestGetMessage:
     def test_leaves_message_on_queue(self, conn: Redis):
@@ -96,6 +208,19 @@ class TestGetMessage:
         with pytest.raises(NoMessageInQueue):
             q.get(raise_on_empty=True)
 
+    def test_passes_the_raw_body_to_the_deserializer(self, conn: Redis):
+        """The deserializer gets the message body as the bytes stored in Redis."""
+        bodies = []
+
+        def deserializer(message: bytes) -> str:
+            bodies.append(message)
+            return message.decode("utf8")
+
+        q = Queue(conn, "test_queue", serializer=lambda message: message.encode("utf8"), deserializer=deserializer)
+        q.push("test", delay=0)
+        assert q.get().data == "test"
+        assert bodies == [b"test"]
+
 
 class TestDeleteMessage:
     def test_deletes_message_from_queue(self, conn: Redis):
@@ -139,6 +264,15 @@ def test_push_many(conn: Redis):
     assert all(isinstance(msg_id, str) for msg_id in msg_ids)
 
 
+def test_push_many_sends_every_chunk(conn: Redis):
+    """Messages split into several chunks are all sent, and their ids returned in order."""
+    q = Queue(conn, "test_queue")
+    msg_ids = q.push_many(["test", "test2", "test3"], delay=0, chunk_size=2)
+    assert len(msg_ids) == 3
+    assert [msg.data for msg in q.pop_many(5)] == ["test", "test2", "test3"]
+    assert q.push_many([]) == []
+
+
 def test_pop_returns_message_and_deletes_it(conn: Redis):
     """Test pop method."""
     q = Queue(conn, "test_queue")
@@ -151,6 +285,47 @@ def test_pop_returns_message_and_deletes_it(conn: Redis):
     assert q.metadata().msgs == 0
 
 
+def test_get_many_returns_deserialized_messages(conn: Redis):
+    """get_many receives several messages in one call and leaves them on the queue."""
+    q = Queue(conn, "test_queue")
+    msg_ids = q.push_many([{"a": 1}, {"b": 2}, {"c": 3}], delay=0)
+    msgs = q.get_many(2)
+    assert [msg.message_id for msg in msgs] == msg_ids[:2]
+    assert [msg.data for msg in msgs] == [{"a": 1}, {"b": 2}]
+    assert q.metadata().msgs == 3
+
+
+def test_pop_many_deletes_messages(conn: Redis):
+    """pop_many receives several messages in one call and deletes them."""
+    q = Queue(conn, "test_queue")
+    q.push_many(["test", "test2", "test3"], delay=0)
+    msgs = q.pop_many(5)
+    assert [msg.data for msg in msgs] == ["test", "test2", "test3"]
+    assert q.metadata().msgs == 0
+    assert q.pop_many(5) == []
+
+
+def test_pop_many_leaves_undeserializable_messages_on_the_queue(conn: Redis):
+    """A message that can't be deserialized is not deleted, and doesn't stop the others being popped."""
+    q = Queue(conn, "test_queue")
+    q.push_many([{"a": 1}, {"b": 2}], delay=0)
+    queue_ops.push_message(conn, "test_queue", b"not json", delay=0)
+    msgs = q.pop_many(10)
+    assert [msg.data for msg in msgs] == [{"a": 1}, {"b": 2}]
+    metadata = q.metadata()
+    assert metadata.msgs == 1
+    assert metadata.hiddenmsgs == 1
+
+
+def test_push_many_reports_the_unserializable_message(conn: Redis):
+    """A message in a batch that can't be serialized raises an error naming it."""
+    q = Queue(conn, "test_queue")
+    with pytest.raises(UnserializableMessage) as exc_info:
+        q.push_many(["test", object()])
+    assert type(exc_info.value.message) is object
+    assert q.metadata().msgs == 0
+
+
 def test_pop_on_empty_queue_returns_none(conn: Redis):
     """Test pop method on an empty queue returns None."""
     q = Queue(conn, "test_queue")
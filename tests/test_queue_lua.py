@@ -1,13 +1,12 @@
 """Test the low-level queue functions in lua."""
 
-import datetime
+from time import time_ns
 
 import pytest
 import redis
-import umsgpack
 from redis.client import Redis
 
-from psmq.utils import list_to_dict
+from psmq.serialize import unpack_metadata
 
 
 def test_b36_encode(conn: Redis):
@@ -38,13 +37,22 @@ def test_b36_decode(conn: Redis):
 
 def test_make_message_id(conn: Redis):
     """A message id should be sortable and unique."""
-    ts_usec = int(datetime.datetime.now().timestamp() * 1_000_000)
+    ts_usec = time_ns() // 1_000
     r = conn.fcall("make_message_id", 1, ts_usec).decode("utf8")
     assert len(r) > 22
     ts_encoding = r[:-22]
     assert int(ts_encoding, 36) == ts_usec
 
 
+def test_make_message_id_uses_the_server_time(conn: Redis):
+    """Without a timestamp, the message id starts with the Redis server's time."""
+    before = conn.time()
+    r = conn.fcall("make_message_id", 0).decode("utf8")
+    after = conn.time()
+    ts_usec = int(r[:-22], 36)
+    assert before[0] * 1_000_000 + before[1] <= ts_usec <= after[0] * 1_000_000 + after[1]
+
+
 def test_create_queue(conn: Redis):
     """A queue is created."""
     r = conn.fcall("create_queue", 4, "test_queue", 10, 0, 0)
@@ -56,53 +64,70 @@ def test_create_queue(conn: Redis):
 
 def test_get_queue_info(conn: Redis):
     """We get information about a queue."""
-    ts = int(datetime.datetime.now().timestamp())
-    r = list_to_dict(conn.fcall("get_queue_info", 1, "test_queue"))
-
-    assert int(r["vt"]) == 60  # vt
-    assert int(r["delay"]) == 0  # delay
-    assert int(r["maxsize"]) == 65565  # maxsize
-    assert int(r["created"]) >= ts  # created
-    assert int(r["modified"]) >= ts  # modified
-    assert int(r["totalrecv"]) == 0  # totalrecv
-    assert int(r["totalsent"]) == 0  # totalsent
-    assert int(r["msgs"]) == 0  # nummsgs
-    assert int(r["hiddenmsgs"]) == 0  # hiddenmsgs
+    ts = time_ns() // 1_000_000_000
+    r = conn.fcall("get_queue_info", 1, "test_queue")
+
+    assert r[0] == 60  # vt
+    assert r[1] == 0  # delay
+    assert r[2] == 65565  # maxsize
+    assert r[3] >= ts  # created
+    assert r[4] >= ts  # modified
+    assert r[5] == 0  # totalrecv
+    assert r[6] == 0  # totalsent
+    assert r[7] == 0  # nummsgs
+    assert r[8] == 0  # hiddenmsgs
     assert conn.sismember("QUEUES", "test_queue")
 
     r = conn.fcall("create_queue", 4, "test_queue2", 10, 10, 10)
     assert r == 1
-    r = list_to_dict(conn.fcall("get_queue_info", 1, "test_queue2"))
-    assert int(r["vt"]) == 10  # vt
-    assert int(r["delay"]) == 10  # delay
-    assert int(r["maxsize"]) == 10  # maxsize
+    r = conn.fcall("get_queue_info", 1, "test_queue2")
+    assert r[0] == 10  # vt
+    assert r[1] == 10  # delay
+    assert r[2] == 10  # maxsize
+
+
+def test_peek_queue_info(conn: Redis):
+    """Peeking reads an existing queue's info, but doesn't create a missing queue."""
+    assert conn.fcall_ro("peek_queue_info", 1, "test_queue") is None
+    assert not conn.sismember("QUEUES", "test_queue")
+
+    conn.fcall("create_queue", 4, "test_queue", 10, 20, 30)
+    r = conn.fcall_ro("peek_queue_info", 1, "test_queue")
+    assert r == conn.fcall("get_queue_info", 1, "test_queue")
+    assert r[:3] == [10, 20, 30]  # vt, delay, maxsize
 
 
 def test_set_queue_vt(conn: Redis):
     """Can set the visibility timeout."""
-    r = conn.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe = conn.pipeline(transaction=False)
+    pipe.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe.fcall("set_queue_viz_timeout", 2, "test_queue", 20)
+    pipe.fcall_ro("peek_queue_info", 1, "test_queue")
+    r, _, info = pipe.execute()
     assert r == 1
-    conn.fcall("set_queue_viz_timeout", 2, "test_queue", 20)
-    r = list_to_dict(conn.fcall("get_queue_info", 1, "test_queue"))
-    assert int(r["vt"]) == 20  # vt
+    assert info[0] == 20  # vt
 
 
 def test_set_queue_initial_delay(conn: Redis):
     """Can set the initial delay."""
-    r = conn.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe = conn.pipeline(transaction=False)
+    pipe.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe.fcall("set_queue_initial_delay", 2, "test_queue", 20)
+    pipe.fcall_ro("peek_queue_info", 1, "test_queue")
+    r, _, info = pipe.execute()
     assert r == 1
-    conn.fcall("set_queue_initial_delay", 2, "test_queue", 20)
-    r = list_to_dict(conn.fcall("get_queue_info", 1, "test_queue"))
-    assert int(r["delay"]) == 20  # delay
+    assert info[1] == 20  # delay
 
 
 def test_set_queue_max_size(conn: Redis):
     """Can set the max size for a queue."""
-    r = conn.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe = conn.pipeline(transaction=False)
+    pipe.fcall("create_queue", 4, "test_queue", 10, 10, 10)
+    pipe.fcall("set_queue_max_size", 2, "test_queue", 20)
+    pipe.fcall_ro("peek_queue_info", 1, "test_queue")
+    r, _, info = pipe.execute()
     assert r == 1
-    conn.fcall("set_queue_max_size", 2, "test_queue", 20)
-    r = list_to_dict(conn.fcall("get_queue_info", 1, "test_queue"))
-    assert int(r["maxsize"]) == 20  # maxsize
+    assert info[2] == 20  # maxsize
 
 
 def test_create_queue_defaults(conn: Redis):
@@ -119,15 +144,19 @@ def test_create_queue_defaults(conn: Redis):
 
 def test_push_message(conn: Redis):
     """You can send a message to an existing queue."""
-    ts_msec = int((datetime.datetime.now().timestamp()) * 1_000)
-    r = conn.fcall("create_queue", 1, "test_queue")
+    ts_msec = time_ns() // 1_000_000
+    pipe = conn.pipeline(transaction=False)
+    pipe.fcall("create_queue", 1, "test_queue")
+    pipe.fcall("push_message", 3, "test_queue", "foo", 0)
+    r, msg_id = pipe.execute()
     assert r == 1
-    msg_id = conn.fcall("push_message", 3, "test_queue", "foo", 0).decode("utf8")
-    msg = conn.hget("test_queue:Q", msg_id).decode("utf8")
-    metadata = conn.hget("test_queue:Q", f"{msg_id}:metadata")
-    assert msg == "foo"
-    assert metadata.startswith(b"\x81\xa4sent")
-    messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    msg_id = msg_id.decode("utf8")
+    pipe.hget("test_queue:Q", msg_id)
+    pipe.hget("test_queue:Q", f"{msg_id}:metadata")
+    pipe.zrange("test_queue", 0, -1, withscores=True)
+    msg, metadata, messages = pipe.execute()
+    assert msg.decode("utf8") == "foo"
+    assert metadata == b"\x80"
     assert len(messages) == 1
     assert messages[0][0].decode("utf8") == msg_id
     assert int(messages[0][1]) >= ts_msec
@@ -135,12 +164,14 @@ def test_push_message(conn: Redis):
 
 def test_push_message_overrides_delay(conn: Redis):
     """You can send a message to an existing queue and override its delay."""
-    r = conn.fcall("create_queue", 3, "test_queue", "", 10)
+    pipe = conn.pipeline(transaction=False)
+    pipe.fcall("create_queue", 3, "test_queue", "", 10)
+    pipe.fcall("push_message", 2, "test_queue", "should be delayed")
+    pipe.fcall("push_message", 3, "test_queue", "should not be delayed", 0)
+    pipe.zrange("test_queue", 0, -1, withscores=True)
+    r, msg_id1, msg_id2, messages = pipe.execute()
     assert r == 1
-    msg_id1 = conn.fcall("push_message", 2, "test_queue", "should be delayed").decode("utf8")
-    msg_id2 = conn.fcall("push_message", 3, "test_queue", "should not be delayed", 0).decode("utf8")
-
-    messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    msg_id1, msg_id2 = msg_id1.decode("utf8"), msg_id2.decode("utf8")
     assert len(messages) == 2
     msg2 = messages[0]
     msg1 = messages[1]
@@ -151,7 +182,7 @@ def test_push_message_overrides_delay(conn: Redis):
 
 def test_push_message_missing_queue(conn: Redis):
     """You can send a message to a non-existing queue."""
-    ts_msec = int((datetime.datetime.now().timestamp()) * 1_000)
+    ts_msec = time_ns() // 1_000_000
     msg_id = conn.fcall("push_message", 3, "test_queue", "foo", 0).decode("utf8")
     msg = conn.hget("test_queue:Q", msg_id).decode("utf8")
     assert msg == "foo"
@@ -162,7 +193,25 @@ def test_push_message_missing_queue(conn: Redis):
     assert int(messages[0][1]) >= ts_msec
 
 
-def test_get_message(conn: Redis):
+def test_push_messages(conn: Redis):
+    """You can send several messages in one call, and their ids keep the order they were sent in."""
+    msg_ids = conn.fcall("push_messages", 5, "test_queue", 0, "", "foo", "bar")
+    assert len(msg_ids) == 2
+    assert msg_ids == sorted(msg_ids)
+    assert [conn.hget("test_queue:Q", msg_id) for msg_id in msg_ids] == [b"foo", b"bar"]
+    assert conn.zrange("test_queue", 0, -1) == msg_ids
+    assert conn.hget("test_queue:Q", "totalsent") == b"2"
+
+
+def test_pop_messages_rejects_a_negative_count(conn: Redis):
+    """A negative count is an error, instead of popping the whole queue."""
+    conn.fcall("push_messages", 5, "test_queue", 0, "", "foo", "bar")
+    with pytest.raises(redis.ResponseError):
+        conn.fcall("pop_messages", 2, "test_queue", -1)
+    assert conn.zcard("test_queue") == 2
+
+
+def test_get_message(conn: Redis, snapshot):
     """You can get a message from an existing queue."""
     viz_timeout = 10
     msg_id = conn.fcall("push_message", 3, "test_queue", "foo", 0).decode("utf8")
@@ -172,14 +221,16 @@ def test_get_message(conn: Redis):
     assert len(pre_messages) == 1
 
     # Get and verify the message
-    msg = list_to_dict(conn.fcall("get_message", 2, "test_queue", viz_timeout))
-    assert msg["msg_id"] == msg_id
-    assert msg["msg_body"] == "foo"
-    assert umsgpack.unpackb(msg["metadata"]) == {"sent": int(pre_messages[0][1]) / 1000}
-    assert msg["rc"] == 1
+    msg_id_reply, msg_body, rc, fr, sent, metadata = conn.fcall("get_message", 2, "test_queue", viz_timeout)
+    assert msg_id_reply.decode("utf8") == msg_id
+    assert msg_body == b"foo"
+    assert unpack_metadata(metadata) == {}
+    assert sent == int(pre_messages[0][1])
+    assert rc == 1
+    assert int(fr) >= int(pre_messages[0][1])
 
     # Get the sorted messages after the get_message call
-    post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    post_messages, queue_stats = snapshot("test_queue")
     assert len(post_messages) == 1
 
     # Verify the score was updated by the viz_timeout * 1,000
@@ -188,7 +239,6 @@ def test_get_message(conn: Redis):
     assert delayed_ts - sent_ts == viz_timeout * 1_000
 
     # verify the queue stats
-    queue_stats = conn.hgetall("test_queue:Q")
     assert queue_stats[b"totalrecv"] == b"1"
     assert queue_stats[b"totalsent"] == b"1"
 
@@ -198,11 +248,11 @@ def test_get_message_no_message_on_queue(conn: Redis):
     conn.fcall("create_queue", 3, "test_queue", "", 10)
 
     # Get and verify the message
-    msg = list_to_dict(conn.fcall("get_message", 1, "test_queue"))
-    assert msg == {}
+    msg = conn.fcall("get_message", 1, "test_queue")
+    assert msg == []
 
 
-def test_get_message_uses_default_vt(conn: Redis):
+def test_get_message_uses_default_vt(conn: Redis, snapshot):
     """You can get a message from an existing queue and it uses the queue's default visibility timeout."""
     viz_timeout = 10
     conn.fcall("create_queue", 4, "test_queue", viz_timeout, 0, 0)
@@ -216,7 +266,7 @@ def test_get_message_uses_default_vt(conn: Redis):
     conn.fcall("get_message", 1, "test_queue")
 
     # Get the sorted messages after the get_message call
-    post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    post_messages, queue_stats = snapshot("test_queue")
     assert len(post_messages) == 1
 
     # Verify the score was updated by the queue's viz_timeout * 1,000
@@ -225,12 +275,11 @@ def test_get_message_uses_default_vt(conn: Redis):
     assert delayed_ts - sent_ts == viz_timeout * 1_000
 
     # verify the queue stats
-    queue_stats = conn.hgetall("test_queue:Q")
     assert queue_stats[b"totalrecv"] == b"1"
     assert queue_stats[b"totalsent"] == b"1"
 
 
-def test_delete_message(conn: Redis):
+def test_delete_message(conn: Redis, snapshot):
     """Deleting a message should remove it from the queue."""
     msg_id = conn.fcall("push_message", 3, "test_queue", "foo", 0).decode("utf8")
 
@@ -242,11 +291,10 @@ def test_delete_message(conn: Redis):
     conn.fcall("delete_message", 2, "test_queue", msg_id)
 
     # Get the sorted messages after the get_message call
-    post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    post_messages, queue_stats = snapshot("test_queue")
     assert len(post_messages) == 0
 
     # verify the queue stats
-    queue_stats = conn.hgetall("test_queue:Q")
     assert queue_stats[b"totalrecv"] == b"0"
     assert queue_stats[b"totalsent"] == b"1"
     assert msg_id.encode("utf8") not in queue_stats
@@ -255,7 +303,7 @@ def test_delete_message(conn: Redis):
     assert f"{msg_id}:metadata".encode("utf8") not in queue_stats
 
 
-def test_delete_missing_message(conn: Redis):
+def test_delete_missing_message(conn: Redis, snapshot):
     """Deleting a non-existing message should do nothing."""
     conn.fcall("create_queue", 1, "test_queue")
 
@@ -267,16 +315,15 @@ def test_delete_missing_message(conn: Redis):
     conn.fcall("delete_message", 2, "test_queue", "foo")
 
     # Get the sorted messages after the get_message call
-    post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    post_messages, queue_stats = snapshot("test_queue")
     assert len(post_messages) == 0
 
     # verify the queue stats
-    queue_stats = conn.hgetall("test_queue:Q")
     assert queue_stats[b"totalrecv"] == b"0"
     assert queue_stats[b"totalsent"] == b"0"
 
 
-def test_pop_message(conn: Redis):
+def test_pop_message(conn: Redis, snapshot):
     """Popping a message should remove it from the queue."""
     msg_id = conn.fcall("push_message", 3, "test_queue", "foo", 0).decode("utf8")
 
@@ -285,17 +332,16 @@ def test_pop_message(conn: Redis):
     assert len(pre_messages) == 1
 
     # Get and verify the message
-    msg = list_to_dict(conn.fcall("pop_message", 1, "test_queue"))
-    assert msg["msg_id"] == msg_id
-    assert msg["msg_body"] == "foo"
-    assert msg["rc"] == 1
+    msg_id_reply, msg_body, rc, _, _, _ = conn.fcall("pop_message", 1, "test_queue")
+    assert msg_id_reply.decode("utf8") == msg_id
+    assert msg_body == b"foo"
+    assert rc == 1
 
     # Get the sorted messages after the get_message call
-    post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+    post_messages, queue_stats = snapshot("test_queue")
     assert len(post_messages) == 0
 
     # verify the queue stats
-    queue_stats = conn.hgetall("test_queue:Q")
     assert queue_stats[b"totalrecv"] == b"1"
     assert queue_stats[b"totalsent"] == b"1"
 
@@ -305,5 +351,5 @@ def test_pop_message_empty_queue(conn: Redis):
     conn.fcall("create_queue", 1, "test_queue")
 
     # Get and verify the message
-    msg = list_to_dict(conn.fcall("pop_message", 1, "test_queue"))
-    assert msg == {}
+    msg = conn.fcall("pop_message", 1, "test_queue")
+    assert msg == []
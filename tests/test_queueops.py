@@ -1,12 +1,15 @@
 """Tests for `psmq` package."""
 
 import datetime
+from time import time_ns
 
 import pytest
-from msgpack import unpackb
+from redis import ResponseError
 from redis.client import Redis
 
 from psmq import queue_ops
+from psmq.exceptions import ValueTooLow
+from psmq.serialize import unpack_metadata
 
 
 def test_list_queues_returns_a_set_of_queue_names(conn: Redis):
@@ -20,6 +23,15 @@ def test_list_queues_returns_a_set_of_queue_names(conn: Redis):
     assert queue_ops.list_queues(conn) == {"test_queue", "test_queue2"}
 
 
+def test_iter_queues_yields_every_queue_name(conn: Redis):
+    """Iterating over the queues streams every name, however small the batch."""
+    for i in range(5):
+        conn.fcall("create_queue", 1, f"test_queue{i}")
+    names = queue_ops.iter_queues(conn, count=2)
+    assert not isinstance(names, (set, frozenset, list))
+    assert set(names) == {f"test_queue{i}" for i in range(5)}
+
+
 class TestCreateQueue:
     """Tests for creating and deleting queues."""
 
@@ -57,7 +69,7 @@ class TestDeleteQueue:
 
 def test_get_queue_info_returns_a_dict_of_metadata(conn: Redis):
     """We get information about a queue."""
-    ts = int(datetime.datetime.now().timestamp())
+    ts = time_ns() // 1_000_000_000
     r = queue_ops.get_queue_info(conn, "test_queue")
 
     assert r["config"].visibility_timeout == 60
@@ -81,6 +93,37 @@ def test_get_queue_info_returns_a_dict_of_metadata(conn: Redis):
     assert r["config"].max_size == 10
 
 
+class TestCreateOrGetQueue:
+    """Tests for creating a queue and getting its info at once."""
+
+    def test_creates_the_queue_with_the_config(self, conn: Redis):
+        """A missing queue is created with the passed configuration."""
+        r = queue_ops.create_or_get_queue(conn, "test_queue", 10, 20, 30)
+        assert conn.sismember("QUEUES", "test_queue")
+        assert r["config"].visibility_timeout == 10
+        assert r["config"].initial_delay == 20
+        assert r["config"].max_size == 30
+        assert r["metadata"].msgs == 0
+
+    def test_existing_queue_keeps_its_config(self, conn: Redis):
+        """An existing queue's configuration isn't changed."""
+        queue_ops.create_queue(conn, "test_queue", 10, 20, 30)
+        r = queue_ops.create_or_get_queue(conn, "test_queue")
+        assert r["config"].visibility_timeout == 10
+        assert r["config"].initial_delay == 20
+        assert r["config"].max_size == 30
+
+
+def test_set_queue_attributes_changes_only_passed_values(conn: Redis):
+    """Can set several attributes at once."""
+    queue_ops.create_queue(conn, "test_queue", 10, 10, 10)
+    queue_ops.set_queue_attributes(conn, "test_queue", vt=20, max_size=30)
+    r = queue_ops.get_queue_info(conn, "test_queue")
+    assert r["config"].visibility_timeout == 20
+    assert r["config"].initial_delay == 10
+    assert r["config"].max_size == 30
+
+
 def test_set_queue_visibility_timeout_changes_the_value(conn: Redis):
     """Can set the visibility timeout."""
     r = queue_ops.create_queue(conn, "test_queue", 10, 10, 10)
@@ -113,7 +156,7 @@ class TestPushMessage:
 
     def test_can_send_to_an_existing_queue(self, conn: Redis):
         """You can send a message to an existing queue."""
-        ts_msec = int((datetime.datetime.now().timestamp()) * 1_000)
+        ts_msec = time_ns() // 1_000_000
         r = queue_ops.create_queue(conn, "test_queue")
         assert r
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"), 0)
@@ -122,12 +165,11 @@ class TestPushMessage:
 
         messages = conn.zrange("test_queue", 0, -1, withscores=True)
         assert len(messages) == 1
-        assert messages[0][0].decode("utf8") == msg_id
+        assert messages[0][0] == msg_id
         assert int(messages[0][1]) >= ts_msec
 
     def test_can_send_to_a_nonexisting_queue(self, conn: Redis):
         """You can send a message to a non-existing queue."""
-        int((datetime.datetime.now().timestamp()) * 1_000)
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"), 0)
         msg = conn.hget("test_queue:Q", msg_id).decode("utf8")
         assert msg == "foo"
@@ -150,8 +192,8 @@ class TestPushMessage:
 
         msg2 = messages[0]
         msg1 = messages[1]
-        assert msg1[0].decode("utf8") == msg_id
-        assert msg2[0].decode("utf8") == msg_id2
+        assert msg1[0] == msg_id
+        assert msg2[0] == msg_id2
         assert int(msg1[1]) > int(msg2[1])
 
     def test_can_send_metadata_with_message(self, conn: Redis):
@@ -159,10 +201,9 @@ class TestPushMessage:
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"), metadata={"foo": "bar"})
 
         # metadata is stored as a msgpack blob
-        msg_metadata = unpackb(conn.hget("test_queue:Q", f"{msg_id}:metadata"))
+        msg_metadata = unpack_metadata(conn.hget("test_queue:Q", msg_id + b":metadata"))
 
-        assert msg_metadata["foo"] == "bar"
-        assert "sent" in msg_metadata
+        assert msg_metadata == {"foo": "bar"}
 
     def test_raises_error_if_metadata_is_not_dict(self, conn: Redis):
         """You can send a message with metadata."""
@@ -170,28 +211,73 @@ class TestPushMessage:
             queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"), metadata="foo")
 
 
+def test_push_messages_sends_all_messages(conn: Redis):
+    """You can send several messages at once."""
+    msg_ids = queue_ops.push_messages(conn, "test_queue", [b"foo", b"bar"], 0)
+    assert len(msg_ids) == 2
+    assert all(isinstance(msg_id, bytes) for msg_id in msg_ids)
+    assert [conn.hget("test_queue:Q", msg_id) for msg_id in msg_ids] == [b"foo", b"bar"]
+
+    messages = conn.zrange("test_queue", 0, -1)
+    assert set(messages) == set(msg_ids)
+
+
+def test_push_messages_in_chunks(conn: Redis, mocker):
+    """Messages sent in chunks share one pipeline, all arrive and keep their order."""
+    messages = [str(i).encode("utf8") for i in range(5)]
+    pipeline = mocker.spy(conn, "pipeline")
+    msg_ids = queue_ops.push_messages(conn, "test_queue", messages, 0, chunk_size=2)
+    assert pipeline.call_count == 1
+    assert len(msg_ids) == 5
+    assert msg_ids == sorted(msg_ids)
+    assert [conn.hget("test_queue:Q", msg_id) for msg_id in msg_ids] == messages
+
+
 class TestGetMessage:
     """Tests for getting messages."""
 
     def test_can_get_a_message_from_an_existing_queue(self, conn: Redis):
         """You can get a message from an existing queue."""
-        ts_msec = int((datetime.datetime.now().timestamp()) * 1_000)
+        ts_msec = time_ns() // 1_000_000
         r = queue_ops.create_queue(conn, "test_queue")
         assert r
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"), 0)
         msg = queue_ops.get_message(conn, "test_queue")
-        assert msg.message_id == msg_id
+        assert msg.message_id == msg_id.decode("utf8")
         assert msg.data == "foo"
         assert msg.retrieval_count == 1
-        assert msg.sent < datetime.datetime.now()
-        assert msg.first_retrieved < datetime.datetime.now()
-        assert "sent" in msg.metadata
+        assert msg.sent_dt < datetime.datetime.now()
+        assert msg.first_retrieved_dt < datetime.datetime.now()
+        assert msg.sent <= msg.first_retrieved
+        assert "sent" not in msg.metadata
 
         messages = conn.zrange("test_queue", 0, -1, withscores=True)
         assert len(messages) == 1
-        assert messages[0][0].decode("utf8") == msg_id
+        assert messages[0][0] == msg_id
         assert int(messages[0][1]) >= ts_msec
 
+    def test_metadata_is_unpacked_on_access(self, conn: Redis):
+        """The message metadata is kept packed until it is read."""
+        queue_ops.push_message(conn, "test_queue", b"foo", 0, metadata={"foo": "bar"})
+        msg = queue_ops.get_message(conn, "test_queue")
+        assert isinstance(msg.raw_metadata, bytes)
+        assert msg.metadata == {"foo": "bar"}
+
+    def test_redelivered_message_keeps_first_retrieved(self, conn: Redis):
+        """Receiving a message again reports the original first-received time as an int."""
+        queue_ops.push_message(conn, "test_queue", b"foo", 0)
+        first = queue_ops.get_message(conn, "test_queue", visibility_timeout=0)
+        second = queue_ops.get_message(conn, "test_queue", visibility_timeout=0)
+        assert second.retrieval_count == 2
+        assert type(second.first_retrieved) is int
+        assert second.first_retrieved == first.first_retrieved
+
+    def test_empty_body_has_no_data(self, conn: Redis):
+        """A message with an empty body is received with ``None`` data."""
+        queue_ops.push_message(conn, "test_queue", b"", 0)
+        msg = queue_ops.get_message(conn, "test_queue")
+        assert msg.data is None
+
     def test_getting_a_message_from_a_nonexisting_queue_returns_none(self, conn: Redis):
         """You can get a message from a non-existing queue, but it is empty."""
         msg = queue_ops.get_message(conn, "test_queue")
@@ -218,11 +304,53 @@ class TestGetMessage:
         delayed_ts = int(post_messages[0][1])
         assert delayed_ts - sent_ts == viz_timeout * 1_000
 
+    def test_can_request_a_message_in_a_pipeline(self, conn: Redis):
+        """A get queued on a pipeline is parsed from its reply."""
+        msg_id = queue_ops.push_message(conn, "test_queue", b"foo", 0)
+        pipe = conn.pipeline(transaction=False)
+        queue_ops.request_message(pipe, "test_queue")
+        queue_ops.request_message(pipe, "test_queue")
+        found, missing = (queue_ops.parse_message_reply("test_queue", reply) for reply in pipe.execute())
+        assert found.message_id == msg_id.decode("utf8")
+        assert found.data == "foo"
+        assert missing is None
+
+
+class TestGetMessages:
+    """Tests for getting several messages at once."""
+
+    def test_gets_up_to_count_messages(self, conn: Redis):
+        """Only ``count`` messages are received, oldest first, and they become hidden."""
+        msg_ids = queue_ops.push_messages(conn, "test_queue", [b"1", b"2", b"3"], delay=0)
+        msgs = queue_ops.get_messages(conn, "test_queue", 2, visibility_timeout=10)
+        assert [msg.message_id.encode("utf8") for msg in msgs] == msg_ids[:2]
+        assert [msg.data for msg in msgs] == ["1", "2"]
+        assert all(msg.retrieval_count == 1 for msg in msgs)
+        remaining = queue_ops.get_messages(conn, "test_queue", 2)
+        assert [msg.message_id.encode("utf8") for msg in remaining] == msg_ids[2:]
+        info = queue_ops.get_queue_info(conn, "test_queue")
+        assert info["metadata"].totalrecv == 3
+
+    def test_empty_queue_returns_empty_list(self, conn: Redis):
+        """Getting messages from an empty queue returns an empty list."""
+        queue_ops.create_queue(conn, "test_queue")
+        assert queue_ops.get_messages(conn, "test_queue", 5) == []
+
+    @pytest.mark.parametrize("count", [0, -1])
+    def test_count_must_be_positive(self, conn: Redis, count: int):
+        """A count below 1 is rejected before anything is received or popped."""
+        queue_ops.push_messages(conn, "test_queue", [b"1", b"2"], delay=0)
+        with pytest.raises(ValueTooLow):
+            queue_ops.get_messages(conn, "test_queue", count)
+        with pytest.raises(ValueTooLow):
+            queue_ops.pop_messages(conn, "test_queue", count)
+        assert queue_ops.get_queue_info(conn, "test_queue")["metadata"].msgs == 2
+
 
 class TestDeleteMessage:
     """Tests for deleting messages."""
 
-    def test_delete_message(self, conn: Redis):
+    def test_delete_message(self, conn: Redis, snapshot):
         """Deleting a message should remove it from the queue."""
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"))
 
@@ -234,16 +362,15 @@ class TestDeleteMessage:
         queue_ops.delete_message(conn, "test_queue", msg_id)
 
         # Get the sorted messages after the get_message call
-        post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+        post_messages, queue_stats = snapshot("test_queue")
         assert len(post_messages) == 0
 
         # verify the queue stats
-        queue_stats = conn.hgetall("test_queue:Q")
         assert queue_stats[b"totalrecv"] == b"0"
         assert queue_stats[b"totalsent"] == b"1"
-        assert msg_id.encode("utf8") not in queue_stats
+        assert msg_id not in queue_stats
 
-    def test_is_idempotent(self, conn: Redis):
+    def test_is_idempotent(self, conn: Redis, snapshot):
         """Deleting a non-existing message should do nothing."""
         conn.fcall("create_queue", 1, "test_queue")
 
@@ -255,11 +382,10 @@ class TestDeleteMessage:
         queue_ops.delete_message(conn, "test_queue", "foo")
 
         # Get the sorted messages after the get_message call
-        post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+        post_messages, queue_stats = snapshot("test_queue")
         assert len(post_messages) == 0
 
         # verify the queue stats
-        queue_stats = conn.hgetall("test_queue:Q")
         assert queue_stats[b"totalrecv"] == b"0"
         assert queue_stats[b"totalsent"] == b"0"
 
@@ -267,7 +393,7 @@ class TestDeleteMessage:
 class TestPopMessage:
     """Tests for popping messages."""
 
-    def test_pop_message(self, conn: Redis):
+    def test_pop_message(self, conn: Redis, snapshot):
         """Popping a message should remove it from the queue."""
         msg_id = queue_ops.push_message(conn, "test_queue", "foo".encode("utf-8"))
 
@@ -277,16 +403,15 @@ class TestPopMessage:
 
         # Get and verify the message
         msg = queue_ops.pop_message(conn, "test_queue")
-        assert msg["msg_id"] == msg_id
+        assert msg["msg_id"] == msg_id.decode("utf8")
         assert msg["msg_body"] == "foo"
         assert msg["rc"] == 1
 
         # Get the sorted messages after the get_message call
-        post_messages = conn.zrange("test_queue", 0, -1, withscores=True)
+        post_messages, queue_stats = snapshot("test_queue")
         assert len(post_messages) == 0
 
         # verify the queue stats
-        queue_stats = conn.hgetall("test_queue:Q")
         assert queue_stats[b"totalrecv"] == b"1"
         assert queue_stats[b"totalsent"] == b"1"
 
@@ -299,3 +424,27 @@ class TestPopMessage:
         # Get and verify the message
         msg = queue_ops.pop_message(conn, "test_queue")
         assert msg == {}
+
+
+class TestMissingLibrary:
+    """Tests for a server that lost the PSMQ library."""
+
+    def test_reloads_the_library_after_a_function_flush(self, conn: Redis):
+        """The library is loaded again and the call retried."""
+        conn.function_flush()
+        msg_id = queue_ops.push_message(conn, "test_queue", b"foo", delay=0)
+        assert queue_ops.get_message(conn, "test_queue").message_id == msg_id.decode("utf8")
+
+    def test_reloads_before_retrying_pushed_chunks(self, conn: Redis):
+        """Every chunk is sent once the library is back."""
+        conn.function_flush()
+        msg_ids = queue_ops.push_messages(conn, "test_queue", (b"%d" % i for i in range(3)), delay=0, chunk_size=2)
+        assert len(msg_ids) == 3
+
+    def test_other_errors_are_raised(self, conn: Redis, mocker):
+        """Errors other than a missing function don't reload the library."""
+        mocker.patch.object(conn, "execute_command", side_effect=ResponseError("WRONGTYPE"))
+        function_load = mocker.spy(conn, "function_load")
+        with pytest.raises(ResponseError):
+            queue_ops.delete_message(conn, "test_queue", "foo")
+        assert function_load.call_count == 0
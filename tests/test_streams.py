@@ -6,6 +6,13 @@ from psmq import stream
 from redis.client import Redis
 
 
+def test_short_id_uses_the_alphabet():
+    """Short ids are 8 characters from the unambiguous alphabet."""
+    ids = {stream.short_id() for _ in range(100)}
+    assert len(ids) == 100
+    assert all(len(i) == 8 and set(i) <= set(stream._SHORT_ID_ALPHABET.decode()) for i in ids)
+
+
 class TestStreamMessage:
     """Make sure StreamMessage works as expected."""
 
@@ -15,6 +22,20 @@ class TestStreamMessage:
         assert message.message_id == "0-0"
         assert message.key == "value"
 
+    def test_get_returns_a_field_or_the_default(self):
+        """Test getting fields that may be missing."""
+        message = stream.StreamMessage("0-0", ["key", "value"])
+        assert message.get("key") == "value"
+        assert message.get("nonexistent_key") is None
+        assert message.get("nonexistent_key", "default") == "default"
+
+    def test_field_names_are_shared_between_messages(self):
+        """Messages with the same field names share the decoded names."""
+        first = stream.StreamMessage(b"0-1", [b"shared_key", b"1"])
+        second = stream.StreamMessage(b"0-2", {b"shared_key": b"2"})
+        assert next(iter(first.fields)) is next(iter(second.fields))
+        assert (first.shared_key, second.shared_key) == ("1", "2")
+
     def test_raises_attribute_error_for_missing_key(self):
         """Test getting an attribute that doesn't exist."""
         message = stream.StreamMessage("0-0", ["key", "value"])
@@ -38,6 +59,14 @@ class TestStream:
             }
         ]
 
+    def test_publish_many(self, conn: Redis):
+        """Messages are published in chunks, and their ids returned in order."""
+        stream_instance = stream.Stream(conn, "test")
+        message_ids = stream_instance.publish_many(({"key": str(i)} for i in range(5)), chunk=2)
+        assert len(message_ids) == 5
+        assert [message_id.decode("utf8") for message_id, _ in conn.xrange("test")] == message_ids
+        assert stream_instance.publish_many([]) == []
+
     def test_create_consumer(self, conn: Redis):
         """Test creating a consumer."""
         stream_instance = stream.Stream(conn, "test")
@@ -62,6 +91,31 @@ class TestConsumer:
         assert len(messages) == 1
         assert messages[0].key == "value"
 
+    def test_get_only_reads_what_the_claim_left(self, conn: Redis):
+        """A get filled by claimed messages doesn't also read new ones and leave them pending."""
+        idle = stream.Consumer(conn, "test", "test_group", "idle_consumer")
+        conn.xadd("test", {"key": "claimed"})
+        idle.get()
+        consumer = stream.Consumer(conn, "test", "test_group", "test_consumer")
+        consumer.max_pending_time = 0
+        conn.xadd("test", {"key": "new"})
+        assert [message.key for message in consumer.get()] == ["claimed"]
+        assert len(conn.xpending_range("test", "test_group", "-", "+", 10, consumername="test_consumer")) == 1
+        other = stream.Consumer(conn, "test", "test_group", "other_consumer")
+        assert [message.key for message in other.pop()] == ["new"]
+
+    def test_get_does_not_return_a_message_twice(self, conn: Redis):
+        """Messages this consumer holds that go idle are not returned twice in one get."""
+        idle = stream.Consumer(conn, "test", "test_group", "idle_consumer")
+        conn.xadd("test", {"key": "claimed"})
+        idle.get()
+        consumer = stream.Consumer(conn, "test", "test_group", "test_consumer")
+        consumer.max_pending_time = 0
+        conn.xadd("test", {"key": "new"})
+        consumer.get()
+        message_ids = [message.message_id for message in consumer.get(count=3)]
+        assert len(message_ids) == len(set(message_ids)) == 2
+
     def test_ack(self, conn: Redis):
         """Test acknowledging messages."""
         consumer = stream.Consumer(conn, "test", "test_group", "test_consumer")
@@ -71,6 +125,15 @@ class TestConsumer:
         messages = consumer.get()
         assert len(messages) == 0
 
+    def test_ack_many_in_batches(self, conn: Redis):
+        """Acknowledging more messages than the batch size acknowledges them all."""
+        consumer = stream.Consumer(conn, "test", "test_group", "test_consumer", ack_batch_size=2)
+        for i in range(5):
+            conn.xadd("test", {"key": str(i)})
+        messages = consumer.get(count=5)
+        consumer.ack(message.message_id for message in messages)
+        assert conn.xpending("test", "test_group")["pending"] == 0
+
     def test_pop(self, conn: Redis):
         """Test popping messages from the stream."""
         consumer = stream.Consumer(conn, "test", "test_group", "test_consumer")
@@ -80,3 +143,26 @@ class TestConsumer:
         assert messages[0].key == "value"
         messages = consumer.get()
         assert len(messages) == 0
+
+    def test_pop_reliable(self, conn: Redis):
+        """Popped messages are acknowledged after they are read."""
+        consumer = stream.Consumer(conn, "test", "test_group", "test_consumer")
+        conn.xadd("test", {"key": "value"})
+        messages = consumer.pop_reliable()
+        assert [message.key for message in messages] == ["value"]
+        assert conn.xpending("test", "test_group")["pending"] == 0
+        assert consumer.pop_reliable() == []
+
+
+def test_pop_many_pops_from_every_stream(conn: Redis):
+    """Messages are popped for all the consumers at once."""
+    consumers = [stream.Consumer(conn, name, "test_group", "test_consumer") for name in ("first", "second", "third")]
+    conn.xadd("first", {"key": "1"})
+    conn.xadd("second", {"key": "2"})
+    messages = stream.pop_many(conn, consumers, count=10)
+    assert {name: [message.key for message in msgs] for name, msgs in messages.items()} == {
+        "first": ["1"],
+        "second": ["2"],
+        "third": [],
+    }
+    assert stream.pop_many(conn, consumers) == {"first": [], "second": [], "third": []}
@@ -35,6 +35,12 @@ class TestValidateQueueName:
     def test_name_with_invalid_chars_returns_false(self):
         assert not validate_queue_name("invalid@name")
 
+    @pytest.mark.parametrize("qname, char", [("a b#c", " "), ("naïve", "ï"), ("tab\tname", "\t")])
+    def test_error_names_the_first_invalid_char(self, qname, char):
+        with pytest.raises(InvalidCharacter) as exc_info:
+            validate_queue_name(qname, raise_on_error=True)
+        assert exc_info.value.character == char
+
 
 class TestValidateInt:
     """Test the validate_int function."""
@@ -66,3 +72,8 @@ class TestValidateInt:
     def test_valid_int_without_min_max_returns_true(self):
         assert validate_int(10)
         assert validate_int(10, raise_on_error=True)
+
+    def test_bool_is_not_an_int(self):
+        assert not validate_int(True)
+        with pytest.raises(TypeError):
+            validate_int(False, raise_on_error=True)